@@ -0,0 +1,69 @@
+# async_ollama_client.py
+import asyncio
+import json
+import logging
+import aiohttp
+
+class AsyncOllamaClient:
+    """asyncio transport for Ollama, for streaming alongside capture and playback tasks.
+
+    Payloads come from OllamaClient.build_payload so both clients send the same requests.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.base_url = f"{config.ollama_url}:{config.ollama_port}"
+        self.timeout = aiohttp.ClientTimeout(sock_connect=config.ollama_connect_timeout, sock_read=config.ollama_read_timeout)
+        self.session = None
+
+    def get_session(self):
+        # Created lazily so the session belongs to the running event loop
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.config.ollama_pool_size)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def post(self, path, payload):
+        attempt = 0
+        while True:
+            try:
+                response = await self.get_session().post(f"{self.base_url}{path}", json=payload)
+                if response.status in (502, 503, 504) and attempt < self.config.ollama_retries:
+                    response.release()
+                else:
+                    response.raise_for_status()
+                    return response
+            except aiohttp.ClientConnectionError:
+                if attempt >= self.config.ollama_retries:
+                    raise
+            await asyncio.sleep(self.config.ollama_backoff * (2 ** attempt))
+            attempt += 1
+
+    async def stream(self, path, payload):
+        response = await self.post(path, payload)
+        try:
+            if not payload.get("stream", True):
+                yield await response.json()
+                return
+            async for line in response.content:
+                if line.strip():
+                    data = json.loads(line)
+                    yield data
+                    if data.get("done", False):
+                        break
+        finally:
+            response.release()
+
+    async def warm_up(self):
+        # A generate request without a prompt only loads the model, and keep_alive keeps it resident
+        logging.info(f"Loading language model '{self.config.language_model}' in Ollama...")
+        try:
+            response = await self.post("/api/generate", {"model": self.config.language_model, "keep_alive": self.config.ollama_keep_alive})
+            response.release()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"Could not warm up the language model: {e}")
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
@@ -0,0 +1,147 @@
+# audio_capture.py
+import logging
+import threading
+import speech_recognition as sr
+
+CAPTURE_SAMPLE_RATE = 16000
+CAPTURE_FRAME_LENGTH = 512
+
+class MicrophoneStream:
+    """Single microphone stream that stays open for the life of the process."""
+
+    def __init__(self, sample_rate=CAPTURE_SAMPLE_RATE, frame_length=CAPTURE_FRAME_LENGTH):
+        self.microphone = sr.Microphone(sample_rate=sample_rate, chunk_size=frame_length)
+        self.source = None
+        self.stopped = False
+
+    @property
+    def sample_rate(self):
+        return self.microphone.SAMPLE_RATE
+
+    @property
+    def sample_width(self):
+        return self.microphone.SAMPLE_WIDTH
+
+    @property
+    def frame_length(self):
+        return self.microphone.CHUNK
+
+    def open(self):
+        if self.source is None:
+            self.source = self.microphone.__enter__()
+            logging.debug(f"Microphone stream opened at {self.sample_rate} Hz, {self.frame_length} samples per frame.")
+        return self
+
+    def read_frame(self):
+        if self.stopped:
+            # Closed by the reading thread itself, since closing the stream under a blocked read is unsafe
+            self.close()
+            raise EOFError("Microphone stream stopped.")
+        if self.source is None:
+            self.open()
+        return self.source.stream.read(self.frame_length)
+
+    def stop(self):
+        # Safe to call from another thread: the read in progress returns within one frame, the next one raises EOFError
+        self.stopped = True
+
+    def close(self):
+        if self.source is not None:
+            self.microphone.__exit__(None, None, None)
+            self.source = None
+
+class AudioCapture:
+    """Long-lived capture service that reads the microphone on a background thread into a ring buffer.
+
+    Every consumer gets its own CaptureReader with an absolute frame cursor, so the wake word detector
+    and the speech recognizer read the same audio and no frames are lost between them.
+    """
+
+    def __init__(self, stream, buffer_seconds):
+        self.stream = stream
+        self.capacity = max(1, int(buffer_seconds * stream.sample_rate / stream.frame_length))
+        self.frames = [None] * self.capacity
+        self.next_index = 0
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return self
+        self.stream.open()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        logging.debug(f"Audio capture started with a {self.capacity} frame ring buffer.")
+        return self
+
+    def run(self):
+        try:
+            while self.running:
+                frame = self.stream.read_frame()
+                with self.condition:
+                    self.frames[self.next_index % self.capacity] = frame
+                    self.next_index += 1
+                    self.condition.notify_all()
+        except Exception as e:
+            logging.error(f"Audio capture failed: {e}")
+        finally:
+            # Readers waiting for the next frame get EOFError instead of waiting forever, e.g. after the device is unplugged
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+
+    def read(self, index):
+        with self.condition:
+            while index >= self.next_index:
+                if not self.running:
+                    raise EOFError("Audio capture stopped.")
+                self.condition.wait()
+            oldest = self.next_index - self.capacity
+            if index < oldest:
+                logging.warning(f"Capture reader fell {oldest - index} frames behind. Skipping ahead.")
+                index = oldest
+            return self.frames[index % self.capacity], index + 1
+
+    def reader(self):
+        return CaptureReader(self)
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            # Wakes readers waiting for a frame that will never come, so they raise EOFError
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.stream.close()
+
+class CaptureReader:
+    """Reads frames from an AudioCapture. Has the same interface as MicrophoneStream."""
+
+    def __init__(self, capture):
+        self.capture = capture
+        self.cursor = capture.next_index
+
+    @property
+    def sample_rate(self):
+        return self.capture.stream.sample_rate
+
+    @property
+    def sample_width(self):
+        return self.capture.stream.sample_width
+
+    @property
+    def frame_length(self):
+        return self.capture.stream.frame_length
+
+    def seek(self, index):
+        self.cursor = index
+
+    def seek_live(self):
+        self.cursor = self.capture.next_index
+
+    def read_frame(self):
+        frame, self.cursor = self.capture.read(self.cursor)
+        return frame
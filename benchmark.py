@@ -0,0 +1,234 @@
+# benchmark.py
+# Replays recorded utterances through the real SpeechRecognizer, OllamaClient and ConversationManager code paths
+# on a headless machine: a fake microphone feeds the WAV files, speech goes to the null TTS engine and a local
+# stand-in for Ollama streams NDJSON at a fixed token rate. Each Whisper model and streaming mode runs in its own
+# process so peak RSS is measured per configuration.
+import argparse
+import glob
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import speech_recognition as sr
+from audio_capture import AudioCapture, CAPTURE_SAMPLE_RATE, CAPTURE_FRAME_LENGTH
+from config import Config
+from conversation_manager import ConversationManager
+from metrics import metrics
+from ollama_client import OllamaClient
+from speech_recognizer import SpeechRecognizer
+
+MODES = {
+    'batch': {'streaming_transcription': False},
+    'streaming': {'streaming_transcription': True},
+}
+
+RESPONSE_TEXT = ("Sure. Here is a short answer to your question, spoken one sentence at a time. "
+                 "This response comes from the benchmark stand-in server. It streams at a fixed token rate.")
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Replay recorded utterances against a local mock Ollama server.")
+    parser.add_argument('--wav-dir', type=str, required=True, help='Directory of recorded utterance WAV files')
+    parser.add_argument('--whisper-models', type=str, default='tiny,base', help='Comma-separated Whisper models to benchmark')
+    parser.add_argument('--modes', type=str, default='batch,streaming', help=f"Comma-separated modes: {', '.join(MODES)}")
+    parser.add_argument('--token-rate', type=float, default=20.0, help='Tokens per second streamed by the mock server')
+    parser.add_argument('--first-token-delay', type=float, default=0.2, help='Seconds before the mock server sends the first token')
+    parser.add_argument('--trailing-silence', type=float, default=1.5, help='Seconds of silence fed after each utterance')
+    parser.add_argument('--output', type=str, help='Write the results as JSON to this file')
+    parser.add_argument('--run-one', type=str, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    token_rate = 20.0
+    first_token_delay = 0.2
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+        chat = self.path == '/api/chat'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        if not payload.get('prompt') and not payload.get('messages'):
+            # Warm-up request
+            self.write_chunk({"model": payload.get("model"), "done": True})
+            return
+        # Leading spaces like real model tokens, so sentence boundaries land at the end of a token
+        words = RESPONSE_TEXT.split(" ")
+        tokens = words[:1] + [" " + word for word in words[1:]]
+        stats = {"eval_count": len(tokens), "eval_duration": int(len(tokens) / self.token_rate * 1e9), "prompt_eval_duration": 0}
+        if not payload.get('stream', True):
+            time.sleep(self.first_token_delay + len(tokens) / self.token_rate)
+            self.write_chunk(dict(self.chunk(chat, RESPONSE_TEXT), done=True, **stats))
+            return
+        time.sleep(self.first_token_delay)
+        try:
+            for token in tokens:
+                self.write_chunk(dict(self.chunk(chat, token), done=False))
+                time.sleep(1.0 / self.token_rate)
+            self.write_chunk(dict(self.chunk(chat, ""), done=True, **stats))
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, as on barge-in
+            pass
+
+    def chunk(self, chat, text):
+        if chat:
+            return {"message": {"role": "assistant", "content": text}}
+        return {"response": text}
+
+    def write_chunk(self, data):
+        self.wfile.write(json.dumps(data).encode() + b"\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+def start_mock_ollama(token_rate, first_token_delay):
+    MockOllamaHandler.token_rate = token_rate
+    MockOllamaHandler.first_token_delay = first_token_delay
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class FakeMicrophone:
+    """Plays queued PCM in real time with the MicrophoneStream interface, and silence when nothing is queued."""
+
+    def __init__(self):
+        self.sample_rate = CAPTURE_SAMPLE_RATE
+        self.sample_width = 2
+        self.frame_length = CAPTURE_FRAME_LENGTH
+        self.frame_bytes = self.frame_length * self.sample_width
+        self.pending = bytearray()
+        self.lock = threading.Lock()
+        self.next_frame_time = None
+
+    def open(self):
+        self.next_frame_time = time.perf_counter()
+        return self
+
+    def queue(self, pcm):
+        with self.lock:
+            self.pending.extend(pcm)
+
+    def read_frame(self):
+        self.next_frame_time += self.frame_length / self.sample_rate
+        delay = self.next_frame_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        with self.lock:
+            frame = bytes(self.pending[:self.frame_bytes])
+            del self.pending[:self.frame_bytes]
+        return frame.ljust(self.frame_bytes, b"\0")
+
+    def close(self):
+        pass
+
+def load_wav(path):
+    with wave.open(path) as wav_file:
+        channels = wav_file.getnchannels()
+        sample_width = wav_file.getsampwidth()
+        audio_data = sr.AudioData(wav_file.readframes(wav_file.getnframes()), wav_file.getframerate(), sample_width)
+    if channels > 1:
+        samples = np.frombuffer(audio_data.frame_data, dtype=np.dtype(f"<i{sample_width}"))
+        mono = samples.reshape(-1, channels).mean(axis=1).astype(samples.dtype)
+        audio_data = sr.AudioData(mono.tobytes(), audio_data.sample_rate, sample_width)
+    return audio_data.get_raw_data(convert_rate=CAPTURE_SAMPLE_RATE, convert_width=2)
+
+def run_configuration(args, whisper_model, mode):
+    server = start_mock_ollama(args.token_rate, args.first_token_delay)
+    config_data = Config.get_default_config()
+    config_data.update(MODES[mode])
+    config_data.update({
+        'mode': 'conversation',
+        'use_whisper': True,
+        'whisper_model': whisper_model,
+        'streaming_capture': True,
+        'shared_capture': True,
+        'tts_engine': 'null',
+        'filler_delay': None,
+        'ollama_url': 'http://127.0.0.1',
+        'ollama_port': server.server_address[1],
+    })
+    config = Config(config_data)
+
+    start_time = time.perf_counter()
+    microphone = FakeMicrophone()
+    capture = AudioCapture(microphone, config.capture_buffer_seconds).start()
+    speech_recognizer = SpeechRecognizer(config, capture)
+    speech_recognizer.get_model()
+    conversation_manager = ConversationManager(config)
+    ollama_client = OllamaClient(config)
+    ollama_client.warm_up()
+    startup_seconds = time.perf_counter() - start_time
+
+    wav_files = sorted(glob.glob(os.path.join(args.wav_dir, '*.wav')))
+    silence = b"\0" * int(args.trailing_silence * CAPTURE_SAMPLE_RATE) * 2
+    audio_seconds = 0.0
+    transcripts = []
+    run_start = time.perf_counter()
+    for path in wav_files:
+        pcm = load_wav(path)
+        audio_seconds += len(pcm) / 2 / CAPTURE_SAMPLE_RATE
+        metrics.start_turn()
+        start_frame = capture.next_index
+        microphone.queue(pcm + silence)
+        text = speech_recognizer.listen_for_speech(start_frame)
+        turn_start = time.perf_counter()
+        ollama_client.send_to_ollama_and_respond(text, conversation_manager)
+        metrics.record('response', time.perf_counter() - turn_start)
+        metrics.end_turn()
+        transcripts.append({"file": os.path.basename(path), "text": text})
+    run_seconds = time.perf_counter() - run_start
+    server.shutdown()
+
+    return {
+        "whisper_model": whisper_model,
+        "mode": mode,
+        "utterances": len(wav_files),
+        "startup_seconds": startup_seconds,
+        "utterances_per_second": len(wav_files) / run_seconds if run_seconds else 0.0,
+        "real_time_factor": run_seconds / audio_seconds if audio_seconds else 0.0,
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024),
+        "stages": metrics.summary(),
+        "transcripts": transcripts,
+    }
+
+def print_report(results):
+    for result in results:
+        print(f"\n== whisper {result['whisper_model']}, {result['mode']} ==")
+        print(f"utterances: {result['utterances']}  startup: {result['startup_seconds']:.2f}s  "
+              f"throughput: {result['utterances_per_second']:.2f} utt/s  real time factor: {result['real_time_factor']:.2f}  "
+              f"peak RSS: {result['peak_rss_mb']:.0f} MB")
+        print(f"{'stage':<24}{'count':>7}{'p50':>10}{'p95':>10}")
+        for name, stats in sorted(result['stages'].items()):
+            print(f"{name:<24}{stats['count']:>7}{stats['p50']:>10.3f}{stats['p95']:>10.3f}")
+
+def main():
+    args = parse_arguments()
+    if args.run_one:
+        logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+        whisper_model, mode = args.run_one.split(',')
+        print(json.dumps(run_configuration(args, whisper_model, mode)))
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    results = []
+    for whisper_model in args.whisper_models.split(','):
+        for mode in args.modes.split(','):
+            logging.info(f"Benchmarking whisper model '{whisper_model}' in {mode} mode...")
+            command = [sys.executable, os.path.abspath(__file__), *sys.argv[1:], '--run-one', f"{whisper_model},{mode}"]
+            output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
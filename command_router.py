@@ -0,0 +1,114 @@
+# command_router.py
+import difflib
+import importlib
+import logging
+import os
+import re
+import yaml
+
+TRIGGER_REGEX_PREFIX = "re:"
+
+def normalize(text):
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+class CommandRouter:
+    """Routes utterances to extensions by the trigger phrases and regexes in each extension's config.yaml.
+
+    All triggers are compiled into one regex, so exact matching does not slow down as extensions are
+    added, and an extension module is only imported the first time one of its triggers matches.
+    When nothing matches exactly, the start of the utterance is fuzzy matched to absorb small ASR
+    mistakes, but only against the phrases with the same number of words and the same first letter,
+    which keeps that fallback bounded too. Extensions that declare no triggers are imported at
+    startup and asked in turn, as before.
+    """
+
+    def __init__(self, extensions_dir, config, fuzzy_cutoff):
+        self.extensions_dir = extensions_dir
+        self.config = config
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.extension_configs = {}
+        self.modules = {}
+        self.fallback_extensions = []
+        self.group_names = {}
+        self.phrases = {}
+        # Fuzzy fallback candidates, bucketed by word count and first letter
+        self.phrase_buckets = {}
+        self.phrase_lengths = set()
+        patterns = []
+        for extension_name, extension_config in self.discover():
+            triggers = (extension_config or {}).get('triggers') or []
+            self.extension_configs[extension_name] = extension_config
+            if not triggers:
+                self.fallback_extensions.append(self.load(extension_name))
+                continue
+            for trigger in triggers:
+                if trigger.startswith(TRIGGER_REGEX_PREFIX):
+                    pattern = trigger[len(TRIGGER_REGEX_PREFIX):]
+                else:
+                    words = normalize(trigger)
+                    if not words:
+                        continue
+                    phrase = " ".join(words)
+                    self.phrases[phrase] = extension_name
+                    self.phrase_buckets.setdefault((len(words), phrase[0]), []).append(phrase)
+                    self.phrase_lengths.add(len(words))
+                    pattern = r"\b" + r"\s+".join(re.escape(word) for word in words) + r"\b"
+                group = f"t{len(patterns)}"
+                self.group_names[group] = extension_name
+                patterns.append(f"(?P<{group}>{pattern})")
+        self.matcher = re.compile("|".join(patterns), re.IGNORECASE) if patterns else None
+        logging.info(f"Routing {len(patterns)} triggers to {len(self.extension_configs) - len(self.fallback_extensions)} extensions.")
+
+    def discover(self):
+        if not os.path.isdir(self.extensions_dir):
+            return
+        for extension_name in sorted(os.listdir(self.extensions_dir)):
+            extension_path = os.path.join(self.extensions_dir, extension_name)
+            module_path = os.path.join(extension_path, f"{extension_name}_extension.py")
+            if not os.path.isfile(module_path):
+                continue
+            extension_config = None
+            extension_config_path = os.path.join(extension_path, "config.yaml")
+            if os.path.isfile(extension_config_path):
+                with open(extension_config_path, 'r') as f:
+                    extension_config = yaml.safe_load(f)
+            yield extension_name, extension_config
+
+    def load(self, extension_name):
+        if extension_name not in self.modules:
+            module = importlib.import_module(f"extensions.{extension_name}.{extension_name}_extension")
+            if hasattr(module, 'initialize'):
+                extension_config = self.extension_configs.get(extension_name)
+                module.initialize(extension_config if extension_config is not None else self.config)
+            self.modules[extension_name] = module
+            logging.debug(f"Loaded extension '{extension_name}'.")
+        return self.modules[extension_name]
+
+    def match(self, text):
+        if self.matcher:
+            found = self.matcher.search(text)
+            if found:
+                return self.group_names[found.lastgroup]
+        words = normalize(text)
+        if not words:
+            return None
+        for length in self.phrase_lengths:
+            phrases = self.phrase_buckets.get((length, words[0][0]))
+            if not phrases or length > len(words):
+                continue
+            close = difflib.get_close_matches(" ".join(words[:length]), phrases, n=1, cutoff=self.fuzzy_cutoff)
+            if close:
+                logging.debug(f"Fuzzy matched '{text}' to trigger '{close[0]}'.")
+                return self.phrases[close[0]]
+        return None
+
+    def dispatch(self, text, conversation_manager, ollama_client):
+        extension_name = self.match(text)
+        if extension_name:
+            module = self.load(extension_name)
+            if hasattr(module, 'handle_command') and module.handle_command(text, conversation_manager, ollama_client):
+                return True
+        for extension in self.fallback_extensions:
+            if hasattr(extension, 'handle_command') and extension.handle_command(text, conversation_manager, ollama_client):
+                return True
+        return False
@@ -1,26 +1,66 @@
 # config.py
 import os
 import logging
+import yaml
 
 class Config:
     def __init__(self, config_data):
         self.mode = config_data.get('mode')
+        self.runtime = config_data.get('runtime')
+        self.barge_in = config_data.get('barge_in')
         self.keyword = config_data.get('keyword')
         self.keyword_timeout = config_data.get('keyword_timeout')
+        self.keyword_spotter = config_data.get('keyword_spotter')
+        self.keyword_threshold = config_data.get('keyword_threshold')
         self.speech_timeout = config_data.get('speech_timeout')
         self.pause_threshold = config_data.get('pause_threshold')
+        self.streaming_capture = config_data.get('streaming_capture')
+        self.shared_capture = config_data.get('shared_capture')
+        self.capture_buffer_seconds = config_data.get('capture_buffer_seconds')
+        self.streaming_transcription = config_data.get('streaming_transcription')
+        self.partial_interval = config_data.get('partial_interval')
         self.max_history = config_data.get('max_history')
+        self.history_token_budget = config_data.get('history_token_budget')
         self.use_whisper = config_data.get('use_whisper')
         self.whisper_model = config_data.get('whisper_model')
+        self.whisper_language = config_data.get('whisper_language')
+        self.background_model_load = config_data.get('background_model_load')
         self.stream_response = config_data.get('stream_response')
+        self.tts_queue_size = config_data.get('tts_queue_size')
+        self.tts_engine = config_data.get('tts_engine')
+        self.filler_delay = config_data.get('filler_delay')
+        self.tts_voice = config_data.get('tts_voice')
+        self.tts_cache_size = config_data.get('tts_cache_size')
         self.language_model = config_data.get('language_model')
+        self.system_prompt = config_data.get('system_prompt')
         self.verbose = config_data.get('verbose')
+        self.server_host = config_data.get('server_host')
+        self.server_port = config_data.get('server_port')
+        self.server_max_sessions = config_data.get('server_max_sessions')
+        self.asr_batch_size = config_data.get('asr_batch_size')
+        self.asr_batch_window = config_data.get('asr_batch_window')
+        self.command_fuzzy_cutoff = config_data.get('command_fuzzy_cutoff')
+        self.metrics_path = config_data.get('metrics_path')
+        self.metrics_prometheus_path = config_data.get('metrics_prometheus_path')
         logging.debug(f"Loaded config: verbose = {self.verbose}")
         self.porcupine_key = config_data.get('porcupine_key')
         self.porcupine_model_path = config_data.get('porcupine_model_path')
         self.ollama_url = config_data.get('ollama_url')
         self.ollama_port = config_data.get('ollama_port')
         self.temperature = config_data.get('temperature')
+        self.ollama_connect_timeout = config_data.get('ollama_connect_timeout')
+        self.ollama_read_timeout = config_data.get('ollama_read_timeout')
+        self.ollama_retries = config_data.get('ollama_retries')
+        self.ollama_backoff = config_data.get('ollama_backoff')
+        self.ollama_pool_size = config_data.get('ollama_pool_size')
+        self.ollama_keep_alive = config_data.get('ollama_keep_alive')
+        self.ollama_api = config_data.get('ollama_api')
+        self.response_cache = config_data.get('response_cache')
+        self.response_cache_path = config_data.get('response_cache_path')
+        self.response_cache_ttl = config_data.get('response_cache_ttl')
+        self.response_cache_size = config_data.get('response_cache_size')
+        self.response_cache_embedding_model = config_data.get('response_cache_embedding_model')
+        self.response_cache_similarity = config_data.get('response_cache_similarity')
         self.history_timeout = config_data.get('history_timeout')
 
         script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -33,20 +73,97 @@ class Config:
     def get_default_config():
         return {
             'mode': 'keyword',
+            'runtime': 'sync',
+            'barge_in': False,
             'keyword': 'hey assistant',
             'keyword_timeout': 5.0,
+            'keyword_spotter': None,
+            'keyword_threshold': 0.5,
             'speech_timeout': 5.0,
             'pause_threshold': 0.8,
+            'streaming_capture': False,
+            'shared_capture': False,
+            'capture_buffer_seconds': 30.0,
+            'streaming_transcription': False,
+            'partial_interval': 0.5,
             'max_history': 10,
+            'history_token_budget': 1500,
             'use_whisper': False,
             'whisper_model': 'tiny',
+            'whisper_language': 'en',
+            'background_model_load': True,
             'stream_response': True,
+            'tts_queue_size': 4,
+            'tts_engine': 'auto',
+            'filler_delay': 1.5,
+            'tts_voice': None,
+            'tts_cache_size': 64,
             'history_timeout': 300,
             'language_model': 'openhermes:7b-mistral-v2.5-q4_K_M',
+            'system_prompt': 'You are a helpful voice assistant. Keep your answers short and conversational, since they are spoken aloud.',
             'verbose': False,
+            'server_host': '0.0.0.0',
+            'server_port': 10400,
+            'server_max_sessions': 8,
+            'asr_batch_size': 8,
+            'asr_batch_window': 0.05,
+            'command_fuzzy_cutoff': 0.8,
+            'metrics_path': None,
+            'metrics_prometheus_path': None,
             'porcupine_key': None,
             'porcupine_model_path': None,
             'ollama_url': 'http://localhost',
             'ollama_port': 11434,
-            'temperature': 0.1
+            'temperature': 0.1,
+            'ollama_connect_timeout': 3.0,
+            'ollama_read_timeout': 120.0,
+            'ollama_retries': 2,
+            'ollama_backoff': 0.5,
+            'ollama_pool_size': 4,
+            'ollama_keep_alive': '30m',
+            'ollama_api': 'chat',
+            'response_cache': False,
+            'response_cache_path': 'response_cache.sqlite3',
+            'response_cache_ttl': 86400,
+            'response_cache_size': 500,
+            'response_cache_embedding_model': None,
+            'response_cache_similarity': 0.92
         }
+
+def load_config(config_path):
+    try:
+        with open(config_path, 'r') as f:
+            config_data = yaml.safe_load(f)
+        return config_data
+    except FileNotFoundError:
+        return {}
+    except yaml.YAMLError as e:
+        logging.error(f"Error loading config file: {e}")
+        return {}
+
+def merge_config_and_args(config_data, args, config_path):
+    merged_config = {}
+
+    # Load default values from Config class
+    default_config = Config.get_default_config()
+
+    # The per-key report is only useful when debugging
+    verbose = getattr(args, 'verbose', None) or config_data.get('verbose', default_config['verbose'])
+    log = logging.info if verbose else logging.debug
+
+    # Merge values based on the specified logic
+    for key in default_config:
+        if hasattr(args, key) and getattr(args, key) is not None:
+            value = getattr(args, key)
+            log(f"Using {key} = {value} provided in command-line argument")
+            merged_config[key] = value
+        elif key in config_data:
+            value = config_data[key]
+            log(f"Using {key} = {value} provided in {config_path}")
+            merged_config[key] = value
+        else:
+            value = default_config[key]
+            log(f"Using default {key} = {value}")
+            merged_config[key] = value
+
+    return merged_config
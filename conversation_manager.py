@@ -1,7 +1,5 @@
 # conversation_manager.py
-from collections import deque
 import random
-import subprocess
 import logging
 import threading
 import select
@@ -9,13 +7,31 @@ import termios
 import tty
 import sys
 import time
+from speech_pipeline import SpeechPipeline
+from tts_engine import create_tts_engine
+from conversation_memory import ConversationMemory, resolve_token_budget
 
 class ConversationManager:
-    def __init__(self, config):
+    GREETINGS = ["Hello.. how can I help you?", "Hey there.. what can I do for you?", "Hi.. ready to assist you.", "Hello"]
+    PROCESSING_RESPONSES = ["Give me a moment to ponder that.", "just a moment, while I consider what you have said"]
+    GOODBYE = "Goodbye!"
+    ERROR_RESPONSE = "Sorry, I could not reach the language model."
+
+    def __init__(self, config, tts_engine=None):
         self.config = config
-        self.conversation_history = deque(maxlen=config.max_history)
+        self.tts_engine = tts_engine or create_tts_engine(config)
+        # Fixed phrases are rendered up front, off the startup path, so they play without any synthesis delay
+        threading.Thread(target=self.tts_engine.preload, args=(self.GREETINGS + self.PROCESSING_RESPONSES + [self.GOODBYE, self.ERROR_RESPONSE],), daemon=True).start()
+        # Role/content messages, one per user turn and one per assistant reply, so the prompt prefix stays stable
+        self.memory = ConversationMemory(resolve_token_budget(config), config.max_history * 2)
+        self.generate_context = None
         self.history_timeout = config.history_timeout
         self.last_interaction_time = time.time()
+        self.speech_pipeline = SpeechPipeline(self, config.tts_queue_size)
+
+    @property
+    def conversation_history(self):
+        return self.memory.messages
 
     def update_last_interaction_time(self):
         self.last_interaction_time = time.time()
@@ -24,36 +40,71 @@ class ConversationManager:
         current_time = time.time()
         if current_time - self.last_interaction_time > self.history_timeout:
             logging.info("Conversation history timed out. Clearing history.")
-            self.conversation_history.clear()
+            self.memory.clear()
+            self.generate_context = None
             self.last_interaction_time = current_time
 
+    def has_history(self):
+        # Any earlier turn, kept or summarized; call after check_history_timeout()
+        return bool(self.memory.messages or self.memory.summary)
+
+    def add_user_message(self, text):
+        self.memory.append({"role": "user", "content": text})
+
+    def add_assistant_message(self, text):
+        self.memory.append({"role": "assistant", "content": text})
+
+    def build_messages(self):
+        return [{"role": "system", "content": self.config.system_prompt}] + self.memory.prompt_messages()
+
     def greet_user(self):
-        greetings = ["Hello.. how can I help you?", "Hey there.. what can I do for you?", "Hi.. ready to assist you.", "Hello"]
-        greeting = random.choice(greetings)
-        subprocess.call(['say', greeting])
+        greeting = random.choice(self.GREETINGS)
+        self.tts_engine.speak(greeting)
 
     def processing_model_response(self):
-        responses = ["Give me a moment to ponder that.", "just a moment, while I consider what you have said"]
-        response = random.choice(responses)
-        subprocess.call(['say', response])
+        response = random.choice(self.PROCESSING_RESPONSES)
+        self.tts_engine.speak(response)
 
     def speak_sentence(self, sentence):
         if self.check_for_spacebar_input_non_blocking():
             logging.info("Interrupted by user before speaking. Listening for keyword...")
             return True
-        subprocess.call(['say', sentence])
+        self.tts_engine.speak(sentence)
         if self.check_for_spacebar_input_non_blocking():
             logging.info("Interrupted by user after speaking. Listening for keyword...")
             return True
         self.update_last_interaction_time()
         return False
 
+    def start_response(self, filler=True):
+        self.speech_pipeline.reset()
+        if filler and self.config.filler_delay is not None:
+            # Only heard if the first sentence takes longer than filler_delay to arrive
+            response = random.choice(self.PROCESSING_RESPONSES)
+            self.speech_pipeline.schedule_filler(response, self.config.filler_delay)
+
+    def queue_sentence(self, sentence):
+        # Returns True when the response was interrupted, like speak_sentence
+        return not self.speech_pipeline.put(sentence)
+
+    def finish_response(self):
+        if self.speech_pipeline.wait():
+            return True
+        self.update_last_interaction_time()
+        return False
+
     def say_goodbye(self):
         logging.info("Goodbye!")
-        if self.speak_sentence("Goodbye!"):
+        if self.speak_sentence(self.GOODBYE):
             return
 
+    def close(self):
+        self.speech_pipeline.close()
+
     def check_for_spacebar_input_non_blocking(self):
+        if not sys.stdin.isatty():
+            time.sleep(0.1)
+            return False
         self.flush_input()
         old_settings = termios.tcgetattr(sys.stdin)
         try:
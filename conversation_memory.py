@@ -0,0 +1,97 @@
+# conversation_memory.py
+import logging
+import threading
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English with the llama/phi tokenizers; close enough for budgeting
+    return len(text) // 4 + 1
+
+# Same as the history_token_budget default in config.py, for a budget that is unset or has no entry for the model
+DEFAULT_TOKEN_BUDGET = 1500
+
+def resolve_token_budget(config):
+    budget = config.history_token_budget
+    if isinstance(budget, dict):
+        model = config.language_model
+        budget = budget.get(model, budget.get(model.split(':')[0], budget.get('default')))
+    if budget is None:
+        logging.warning(f"No history_token_budget for '{config.language_model}'. Using {DEFAULT_TOKEN_BUDGET} tokens.")
+        return DEFAULT_TOKEN_BUDGET
+    return budget
+
+class ConversationMemory:
+    """Conversation messages kept within a token budget and a message count.
+
+    When the history grows past either limit, compact() folds the oldest turns into a rolling summary
+    on a background thread. Until that finishes, prompt_messages() leaves out the oldest messages so
+    the prompt never exceeds them.
+    """
+
+    def __init__(self, token_budget, max_messages):
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+        self.messages = []
+        self.summary = ""
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.summarizing = False
+
+    def append(self, message):
+        with self.lock:
+            self.messages.append(message)
+
+    def clear(self):
+        with self.lock:
+            self.messages = []
+            self.summary = ""
+            self.generation += 1
+
+    def token_count(self, messages):
+        return sum(estimate_tokens(message["content"]) for message in messages)
+
+    def prompt_messages(self):
+        with self.lock:
+            messages = self.messages[-self.max_messages:]
+            summary = self.summary
+        prefix = []
+        if summary:
+            prefix = [{"role": "system", "content": f"Summary of the earlier conversation: {summary}"}]
+        budget = self.token_budget - self.token_count(prefix)
+        # The newest message is the current question and is always kept
+        while len(messages) > 1 and self.token_count(messages) > budget:
+            messages.pop(0)
+        return prefix + messages
+
+    def compact(self, summarizer):
+        with self.lock:
+            overflow = len(self.messages) - self.max_messages
+            if self.summarizing or (overflow <= 0 and self.token_count(self.messages) <= self.token_budget):
+                return
+            # Fold the messages over the count limit, and then the oldest ones until what is left fits in half
+            # the budget, leaving room for the next turns
+            keep_tokens = self.token_count(self.messages)
+            count = 0
+            while count < len(self.messages) - 1 and (count < overflow or keep_tokens > self.token_budget // 2):
+                keep_tokens -= estimate_tokens(self.messages[count]["content"])
+                count += 1
+            folded = self.messages[:count]
+            summary = self.summary
+            generation = self.generation
+            self.summarizing = True
+        threading.Thread(target=self.summarize, args=(summarizer, summary, folded, generation), daemon=True).start()
+
+    def summarize(self, summarizer, summary, folded, generation):
+        try:
+            transcript = "\n".join(f"{message['role']}: {message['content']}" for message in folded)
+            new_summary = summarizer(summary, transcript)
+        except Exception as e:
+            logging.warning(f"Could not summarize conversation history: {e}")
+            new_summary = None
+        with self.lock:
+            self.summarizing = False
+            if new_summary is None or generation != self.generation:
+                return
+            if self.messages[:len(folded)] == folded:
+                del self.messages[:len(folded)]
+            self.summary = new_summary
+        logging.debug(f"Compacted {len(folded)} messages into the conversation summary.")
@@ -0,0 +1,83 @@
+# endpointer.py
+from collections import deque
+import numpy as np
+
+class EnergyEndpointer:
+    """Splits a stream of PCM frames into utterances using frame energy against a tracked noise floor.
+
+    process() returns the raw audio of an utterance once pause_threshold seconds of silence
+    follow speech, or once max_duration is reached, and None otherwise.
+    """
+
+    def __init__(self, sample_rate, sample_width, frame_length, pause_threshold, max_duration,
+                 energy_ratio=3.0, min_energy=150.0, onset_duration=0.1, pre_roll=0.3, noise_adapt_rate=0.05):
+        self.sample_width = sample_width
+        frame_seconds = frame_length / sample_rate
+        self.frame_seconds = frame_seconds
+        self.pause_frames = max(1, int(round(pause_threshold / frame_seconds)))
+        self.max_frames = max(1, int(round(max_duration / frame_seconds)))
+        self.onset_frames = max(1, int(round(onset_duration / frame_seconds)))
+        self.energy_ratio = energy_ratio
+        self.min_energy = min_energy
+        self.noise_adapt_rate = noise_adapt_rate
+        self.noise_floor = None
+        # Length and trailing silence of the last utterance, in seconds
+        self.last_duration = 0.0
+        self.last_trailing_silence = 0.0
+        self.pre_roll = deque(maxlen=max(1, int(round(pre_roll / frame_seconds))))
+        self.reset()
+
+    def reset(self):
+        self.frames = []
+        self.in_speech = False
+        self.voiced_run = 0
+        self.silent_run = 0
+        self.pre_roll.clear()
+
+    def frame_energy(self, frame):
+        samples = np.frombuffer(frame, dtype=np.int16 if self.sample_width == 2 else np.int32)
+        if samples.size == 0:
+            return 0.0
+        return float(np.sqrt(np.mean(np.square(samples, dtype=np.float64))))
+
+    def threshold(self):
+        if self.noise_floor is None:
+            return self.min_energy
+        return max(self.min_energy, self.noise_floor * self.energy_ratio)
+
+    def is_voiced(self, frame):
+        energy = self.frame_energy(frame)
+        voiced = energy > self.threshold()
+        if not self.in_speech and not voiced:
+            # Only non-speech frames move the noise floor, so it follows the room rather than the speaker
+            if self.noise_floor is None:
+                self.noise_floor = energy
+            else:
+                self.noise_floor += self.noise_adapt_rate * (energy - self.noise_floor)
+        return voiced
+
+    def process(self, frame):
+        voiced = self.is_voiced(frame)
+        if not self.in_speech:
+            self.pre_roll.append(frame)
+            self.voiced_run = self.voiced_run + 1 if voiced else 0
+            if self.voiced_run >= self.onset_frames:
+                self.in_speech = True
+                self.frames = list(self.pre_roll)
+                self.silent_run = 0
+            return None
+
+        self.frames.append(frame)
+        self.silent_run = 0 if voiced else self.silent_run + 1
+        if self.silent_run >= self.pause_frames or len(self.frames) >= self.max_frames:
+            return self.flush()
+        return None
+
+    def flush(self):
+        # Trailing silence beyond a couple of frames is dead weight for the recognizer
+        keep = len(self.frames) - max(0, self.silent_run - 2)
+        segment = b"".join(self.frames[:keep])
+        self.last_duration = len(self.frames) * self.frame_seconds
+        self.last_trailing_silence = self.silent_run * self.frame_seconds
+        self.reset()
+        return segment
@@ -1,15 +1,26 @@
 import os
 import logging
-import pvporcupine
-from pvrecorder import PvRecorder
+import time
+import numpy as np
 import speech_recognition as sr
+from audio_capture import MicrophoneStream, CaptureReader
+from endpointer import EnergyEndpointer
+from metrics import metrics
 
 class KeywordDetector:
-    def __init__(self, config):
+    def __init__(self, config, capture=None, whisper_model_provider=None, whisper_model_lock=None):
+        # whisper_model_provider returns the already loaded Whisper model, waiting for it if it is still loading;
+        # whisper_model_lock is the lock its other users decode under
         self.config = config
         self.porcupine = None
         self.keyword_paths = []
         self.recognizer = sr.Recognizer()  # Add this line
+        # Capture frame right after the wake word, for the speech recognizer to start from
+        self.detection_frame = None
+        self.detection_confidence = None
+        self.spotter = None
+        self.stopped = False
+        self.reader = capture.reader() if capture is not None else None
         if config.porcupine_key or os.environ.get('PORCUPINE_KEY'):
             activation_key = config.porcupine_key or os.environ.get('PORCUPINE_KEY')
             if os.path.exists(config.models_folder):
@@ -18,6 +29,7 @@ class KeywordDetector:
                         self.keyword_paths.append(os.path.join(config.models_folder, file))
 
             if self.keyword_paths:
+                import pvporcupine
                 self.porcupine = pvporcupine.create(access_key=activation_key, keyword_paths=self.keyword_paths)
                 logging.debug("Porcupine initialized successfully.")
             else:
@@ -25,18 +37,63 @@ class KeywordDetector:
         else:
             logging.warning('Porcupine activation key not provided. Wake word detection will not be used.')
 
-    def listen_for_keyword(self, conversation_manager):  # Add conversation_manager as a parameter
+        # Unset, the Whisper spotter is only used when Whisper is in use anyway, so Google-only setups never load torch
+        keyword_spotter = config.keyword_spotter or ('whisper' if config.use_whisper else 'google')
+        self.use_spotter = not self.porcupine and keyword_spotter == 'whisper'
+        self.whisper_model_provider = whisper_model_provider
+        self.whisper_model_lock = whisper_model_lock
+        if self.use_spotter:
+            logging.info(f"Listening for '{config.keyword}' with the offline keyword spotter.")
+            if self.reader is None:
+                self.reader = MicrophoneStream().open()
+
+        if self.reader is not None:
+            self.endpointer = EnergyEndpointer(
+                self.reader.sample_rate,
+                self.reader.sample_width,
+                self.reader.frame_length,
+                pause_threshold=config.pause_threshold,
+                max_duration=config.keyword_timeout,
+            )
+
+    def get_spotter(self):
+        # Built on first use, so startup does not wait for torch or the Whisper model
+        if self.spotter is None:
+            try:
+                from keyword_spotter import WhisperKeywordSpotter
+                if self.whisper_model_provider is not None:
+                    model = self.whisper_model_provider()
+                else:
+                    import whisper
+                    model = whisper.load_model(self.config.whisper_model)
+            except (ImportError, RuntimeError) as e:
+                # whisper or torch is missing, or the background load failed; Google listens for the keyword instead
+                logging.error(f"Keyword spotter unavailable: {e}. Listening for the keyword with Google speech recognition instead.")
+                self.use_spotter = False
+                return None
+            self.spotter = WhisperKeywordSpotter(model, self.config.keyword, self.config.whisper_language,
+                                                 self.config.keyword_threshold, self.whisper_model_lock)
+        return self.spotter
+
+    def listen_for_keyword(self, conversation_manager, greet=True):  # Add conversation_manager as a parameter
         logging.info("Listening for keyword...")
+        self.detection_frame = None
+        if self.reader is not None:
+            return self.listen_on_capture(conversation_manager, greet)
         if self.porcupine:
+            from pvrecorder import PvRecorder
             recorder = PvRecorder(device_index=-1, frame_length=self.porcupine.frame_length)
             recorder.start()
             try:
-                while True:
+                while not self.stopped:
                     pcm = recorder.read()
+                    start_time = time.perf_counter()
                     result = self.porcupine.process(pcm)
                     if result >= 0:
+                        metrics.record('wake_word_detect', time.perf_counter() - start_time)
                         logging.info("Keyword detected. Ready for speech...")
-                        conversation_manager.greet_user()  # Call greet_user on conversation_manager
+                        if greet:
+                            conversation_manager.greet_user()  # Call greet_user on conversation_manager
                         return True
             finally:
                 recorder.stop()
@@ -45,10 +102,12 @@ class KeywordDetector:
             try:
                 with sr.Microphone() as source:
                     audio = self.recognizer.listen(source, timeout=self.config.keyword_timeout)
-                    detected_text = self.recognizer.recognize_google(audio).lower()
+                    with metrics.span('wake_word_detect'):
+                        detected_text = self.recognizer.recognize_google(audio).lower()
                     if self.config.keyword in detected_text:
                         logging.info("Keyword detected. Ready for speech...")
-                        conversation_manager.greet_user()  # Call greet_user on conversation_manager
+                        if greet:
+                            conversation_manager.greet_user()  # Call greet_user on conversation_manager
                         return True
             except sr.WaitTimeoutError:
                 logging.warning("Listening timed out while waiting for keyword to start.")
@@ -58,3 +117,67 @@ class KeywordDetector:
                 logging.error(f"Could not request results; {e}")
         logging.info("Keyword not detected.")
         return False
+
+    def stop(self):
+        self.stopped = True
+        if isinstance(self.reader, MicrophoneStream):
+            self.reader.stop()
+
+    def mark_speech_start(self):
+        # Call after the greeting has played: speech capture then starts after it, instead of replaying
+        # the greeting the microphone picked up as if the user had said it
+        if isinstance(self.reader, CaptureReader):
+            self.detection_frame = self.reader.capture.next_index
+
+    def listen_on_capture(self, conversation_manager, greet=True):
+        # Same detection as above, but reading frames from a stream that stays open instead of opening a device
+        if isinstance(self.reader, CaptureReader):
+            self.reader.seek_live()
+        if self.porcupine:
+            while True:
+                pcm = np.frombuffer(self.reader.read_frame(), dtype=np.int16)
+                start_time = time.perf_counter()
+                if self.porcupine.process(pcm) >= 0:
+                    metrics.record('wake_word_detect', time.perf_counter() - start_time)
+                    self.detection_frame = self.reader.cursor
+                    self.detection_confidence = 1.0
+                    logging.info("Keyword detected. Ready for speech...")
+                    if greet:
+                        conversation_manager.greet_user()
+                        self.mark_speech_start()
+                    return True
+        self.endpointer.reset()
+        segment = None
+        while segment is None:
+            segment = self.endpointer.process(self.reader.read_frame())
+        spotter = self.get_spotter() if self.use_spotter else None
+        if spotter is not None:
+            with metrics.span('wake_word_detect'):
+                detected, self.detection_confidence = spotter.detect(segment)
+            if detected:
+                self.detection_frame = getattr(self.reader, 'cursor', None)
+                logging.info(f"Keyword detected with confidence {self.detection_confidence:.2f}. Ready for speech...")
+                if greet:
+                    conversation_manager.greet_user()
+                    self.mark_speech_start()
+                return True
+            logging.info("Keyword not detected.")
+            return False
+        try:
+            audio = sr.AudioData(segment, self.reader.sample_rate, self.reader.sample_width)
+            with metrics.span('wake_word_detect'):
+                detected_text = self.recognizer.recognize_google(audio).lower()
+            if self.config.keyword in detected_text:
+                self.detection_frame = self.reader.cursor
+                self.detection_confidence = 1.0
+                logging.info("Keyword detected. Ready for speech...")
+                if greet:
+                    conversation_manager.greet_user()
+                    self.mark_speech_start()
+                return True
+        except sr.UnknownValueError:
+            logging.warning("Could not understand audio.")
+        except sr.RequestError as e:
+            logging.error(f"Could not request results; {e}")
+        logging.info("Keyword not detected.")
+        return False
@@ -0,0 +1,52 @@
+# keyword_spotter.py
+import logging
+import threading
+import numpy as np
+import torch
+import whisper
+
+class WhisperKeywordSpotter:
+    """Offline keyword spotter that scores a segment against the keyword with a forced Whisper decode.
+
+    Instead of transcribing freely and searching the text, the decoder is fed the keyword tokens and
+    the confidence is their average probability, scaled by the probability that the segment holds
+    speech at all. That is one encoder and one decoder pass per segment, with no network access.
+    """
+
+    def __init__(self, model, keyword, language, threshold, model_lock=None):
+        self.model = model
+        # Pass the lock of whoever else decodes with the same model; overlapping decodes corrupt each other
+        self.model_lock = model_lock or threading.Lock()
+        self.threshold = threshold
+        self.tokenizer = whisper.tokenizer.get_tokenizer(model.is_multilingual, language=language, task="transcribe")
+        self.prefix = list(self.tokenizer.sot_sequence_including_notimestamps)
+        # Whisper usually capitalizes the start of an utterance, so score the common spellings and keep the best
+        spellings = {keyword.lower(), keyword.capitalize(), keyword.title()}
+        self.candidates = [self.tokenizer.encode(" " + spelling) for spelling in spellings]
+
+    def score(self, audio):
+        with self.model_lock:
+            return self.forced_score(audio)
+
+    @torch.no_grad()
+    def forced_score(self, audio):
+        mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=self.model.dims.n_mels).to(self.model.device)
+        features = self.model.embed_audio(mel[None].to(next(self.model.parameters()).dtype))
+        best = 0.0
+        no_speech_prob = 0.0
+        for candidate in self.candidates:
+            tokens = torch.tensor([self.prefix + candidate], device=self.model.device)
+            logprobs = self.model.logits(tokens, features)[0].float().log_softmax(dim=-1)
+            # Logits at position i predict token i + 1
+            start = len(self.prefix) - 1
+            target = tokens[0, start + 1:]
+            keyword_logprob = logprobs[start:start + len(candidate)].gather(1, target[:, None]).mean().item()
+            best = max(best, float(np.exp(keyword_logprob)))
+            no_speech_prob = logprobs[self.prefix.index(self.tokenizer.sot), self.tokenizer.no_speech].exp().item()
+        return best * (1.0 - no_speech_prob)
+
+    def detect(self, pcm):
+        audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        confidence = self.score(audio)
+        logging.debug(f"Keyword confidence: {confidence:.2f}")
+        return confidence >= self.threshold, confidence
@@ -0,0 +1,150 @@
+# metrics.py
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import json
+import logging
+import threading
+import time
+
+class Metrics:
+    """Per-turn latency spans, exported as JSON lines and as a Prometheus text snapshot.
+
+    Stages call span() or record(). Everything recorded between start_turn() and end_turn()
+    becomes one JSON line, and the last window of samples per span feeds the p50/p95 summaries.
+    """
+
+    def __init__(self, window=500):
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+        # Running count and sum since startup, which Prometheus expects to only ever grow
+        self.totals = defaultdict(lambda: [0, 0.0])
+        self.marks = {}
+        self.turn = None
+        self.turn_count = 0
+        self.lock = threading.Lock()
+        # Lets a thread that overlaps another turn, like the async listener, keep its spans apart
+        self.local = threading.local()
+        self.jsonl_path = None
+        self.prometheus_path = None
+
+    def configure(self, config):
+        self.jsonl_path = config.metrics_path
+        self.prometheus_path = config.metrics_prometheus_path
+
+    def start_turn(self, carried=None):
+        # carried holds spans and marks collected by detached() before the turn started
+        with self.lock:
+            self.turn_count += 1
+            self.turn = {"turn": self.turn_count, "time": time.time(), "spans": {}}
+            self.marks = {}
+            if carried:
+                for name, value in carried["spans"]:
+                    self.add_to_turn(name, value)
+                self.marks.update(carried["marks"])
+
+    @contextmanager
+    def detached(self):
+        # Spans and marks recorded by this thread are collected here instead of joining the current turn
+        collected = {"spans": [], "marks": {}}
+        self.local.collected = collected
+        try:
+            yield collected
+        finally:
+            self.local.collected = None
+
+    def record(self, name, value):
+        collected = getattr(self.local, 'collected', None)
+        with self.lock:
+            self.samples[name].append(value)
+            self.totals[name][0] += 1
+            self.totals[name][1] += value
+            if collected is not None:
+                collected["spans"].append((name, value))
+            elif self.turn is not None:
+                self.add_to_turn(name, value)
+
+    def add_to_turn(self, name, value):
+        # Spans that happen several times per turn, like tts_sentence, are kept as lists
+        spans = self.turn["spans"]
+        if name in spans:
+            if not isinstance(spans[name], list):
+                spans[name] = [spans[name]]
+            spans[name].append(round(value, 4))
+        else:
+            spans[name] = round(value, 4)
+
+    @contextmanager
+    def span(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_time)
+
+    def mark(self, name):
+        collected = getattr(self.local, 'collected', None)
+        (collected["marks"] if collected is not None else self.marks)[name] = time.perf_counter()
+
+    def record_since(self, name, mark):
+        # Records the time since a mark set earlier in the same turn, once per turn
+        collected = getattr(self.local, 'collected', None)
+        if collected is not None:
+            start_time = collected["marks"].get(mark)
+            recorded = name in (span for span, _ in collected["spans"])
+        else:
+            start_time = self.marks.get(mark)
+            recorded = self.turn is None or name in self.turn["spans"]
+        if start_time is None or recorded:
+            return
+        self.record(name, time.perf_counter() - start_time)
+
+    def record_turn(self, carried):
+        # Writes a turn collected with detached() in one go, for callers whose turns overlap, like server sessions
+        self.start_turn(carried)
+        self.end_turn()
+
+    def end_turn(self):
+        with self.lock:
+            turn, self.turn = self.turn, None
+        if not turn or not turn["spans"]:
+            return
+        logging.debug(f"Turn {turn['turn']} timings: {turn['spans']}")
+        try:
+            if self.jsonl_path:
+                with open(self.jsonl_path, 'a') as f:
+                    f.write(json.dumps(turn) + "\n")
+            if self.prometheus_path:
+                with open(self.prometheus_path, 'w') as f:
+                    f.write(self.prometheus_text())
+        except OSError as e:
+            logging.error(f"Could not write metrics: {e}")
+
+    def summary(self):
+        with self.lock:
+            samples = {name: sorted(values) for name, values in self.samples.items() if values}
+            totals = {name: tuple(total) for name, total in self.totals.items()}
+        return {
+            name: {
+                "count": totals[name][0],
+                "sum": totals[name][1],
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+            }
+            for name, values in samples.items()
+        }
+
+    def prometheus_text(self):
+        lines = []
+        for name, stats in sorted(self.summary().items()):
+            metric = f"lvchat_{name}"
+            lines.append(f"# TYPE {metric} summary")
+            lines.append(f'{metric}{{quantile="0.5"}} {stats["p50"]:.6f}')
+            lines.append(f'{metric}{{quantile="0.95"}} {stats["p95"]:.6f}')
+            lines.append(f"{metric}_sum {stats['sum']:.6f}")
+            lines.append(f"{metric}_count {stats['count']}")
+        return "\n".join(lines) + "\n"
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+metrics = Metrics()
@@ -1,65 +1,223 @@
 # ollama_client.py
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import re
 import logging
-import threading
 import time
+from metrics import metrics
+from response_cache import ResponseCache
+
+def split_sentences(text):
+    return [sentence for sentence in re.split('(?<=[.!?]) +', text) if sentence]
 
 class OllamaClient:
     def __init__(self, config):
         self.config = config
         self.ollama_url = config.ollama_url
         self.ollama_port = config.ollama_port
+        self.timeout = (config.ollama_connect_timeout, config.ollama_read_timeout)
+        # One pooled keep-alive session for the life of the process. Generation requests are POSTs, which urllib3
+        # does not retry by default; retrying them is safe here since a failed generation has no side effects.
+        retries = Retry(
+            total=config.ollama_retries,
+            backoff_factor=config.ollama_backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'POST']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_maxsize=config.ollama_pool_size, max_retries=retries)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.response_cache = None
+        if config.response_cache:
+            embed = self.embed if config.response_cache_embedding_model else None
+            self.response_cache = ResponseCache(
+                config.response_cache_path,
+                config.response_cache_ttl,
+                config.response_cache_size,
+                embed,
+                config.response_cache_similarity,
+                # Answers depend on the model and the system prompt as well as on the question
+                f"{config.language_model}\n{config.system_prompt}",
+            )
+
+    def endpoint(self, path):
+        return f"{self.ollama_url}:{self.ollama_port}{path}"
+
+    def build_payload(self, conversation_manager, text, stream):
+        payload = {
+            "model": self.config.language_model,
+            "stream": stream,
+            "keep_alive": self.config.ollama_keep_alive,
+            "options": {"temperature": self.config.temperature},
+        }
+        if self.config.ollama_api == "chat":
+            payload["messages"] = conversation_manager.build_messages()
+        else:
+            # /api/generate keeps the conversation in the returned context, so only the new turn is sent
+            context = conversation_manager.generate_context
+            if context and len(context) > conversation_manager.memory.token_budget:
+                # The context is the model's own tokens, so its length is exact. Past the budget it is dropped and
+                # the conversation carries on from the summary and the recent turns that fit, as with /api/chat
+                logging.debug(f"Generate context of {len(context)} tokens is over the budget. Starting a new one.")
+                context = conversation_manager.generate_context = None
+            system = self.config.system_prompt
+            if not context:
+                # The newest message is the question itself, sent as the prompt
+                earlier = conversation_manager.memory.prompt_messages()[:-1]
+                if earlier:
+                    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in earlier)
+                    system += f"\n\nEarlier in this conversation:\n{transcript}"
+            payload["system"] = system
+            payload["prompt"] = text
+            if context:
+                payload["context"] = context
+        return payload
+
+    def response_text(self, data):
+        if "message" in data:
+            return data["message"].get("content", "")
+        return data.get("response", "")
+
+    def post(self, path, payload, stream=False):
+        response = self.session.post(self.endpoint(path), json=payload, stream=stream, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def warm_up(self):
+        # A generate request without a prompt only loads the model, and keep_alive keeps it resident
+        logging.info(f"Loading language model '{self.config.language_model}' in Ollama...")
+        start_time = time.time()
+        try:
+            self.post("/api/generate", {"model": self.config.language_model, "keep_alive": self.config.ollama_keep_alive})
+            logging.info(f"Language model ready in {time.time() - start_time:.1f}s.")
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"Could not warm up the language model: {e}")
 
     def send_to_ollama_and_respond(self, text, conversation_manager, prompt=None):
         if text is None:
             logging.info("No text to send for processing.")
             return
-        conversation_manager.conversation_history.append(f"User: {text}")
-        prompt_text = "\n".join(conversation_manager.conversation_history)
-        ollama_url = f"{self.ollama_url}:{self.ollama_port}/api/generate"
-        payload = {"model": self.config.language_model, "prompt": prompt_text, "stream": self.config.stream_response}
-
-        # Start a new thread for the verbal response
-        response_thread = threading.Thread(target=conversation_manager.processing_model_response)
-        response_thread.start()
-
-        # Wait for the verbal response thread to complete
-        response_thread.join()
+        cacheable, cached_response, embedding = self.lookup_cached_response(text, conversation_manager)
+        if cached_response:
+            self.respond_from_cache(cached_response, conversation_manager)
+            return
+        conversation_manager.add_user_message(text)
+        payload = self.build_payload(conversation_manager, text, self.config.stream_response)
+        api_path = f"/api/{self.config.ollama_api}"
 
         logging.info("Sending text to language model for processing...")
+        conversation_manager.start_response()
+        reply = []
+        completed = False
         try:
-            response = requests.post(ollama_url, json=payload, stream=self.config.stream_response)
+            metrics.mark('request')
+            response = self.post(api_path, payload, stream=self.config.stream_response)
             sentence_buffer = ""
             if self.config.stream_response:
                 for line in response.iter_lines():
                     if line:
                         data = json.loads(line)
-                        if self.config.verbose:
-                            logging.info(f"Streamed JSON data: {data}")
-                        if 'response' in data:
-                            sentence_buffer += data['response']
-                            if any(sentence_buffer.endswith(punc) for punc in '.!?'):
-                                if sentence_buffer.strip():
-                                    if conversation_manager.speak_sentence(sentence_buffer):
-                                        return
-                                    conversation_manager.conversation_history.append(f"Ollama: {sentence_buffer}")
-                                    sentence_buffer = ""
-                            if data.get("done", False):
-                                break
+                        sentence_buffer += self.handle_response_data(data, conversation_manager)
+                        if any(sentence_buffer.endswith(punc) for punc in '.!?'):
+                            if sentence_buffer.strip():
+                                reply.append(sentence_buffer.strip())
+                                if conversation_manager.queue_sentence(sentence_buffer):
+                                    response.close()
+                                    return
+                                sentence_buffer = ""
+                        if data.get("done", False):
+                            break
                 if sentence_buffer.strip():
-                    if conversation_manager.speak_sentence(sentence_buffer):
+                    reply.append(sentence_buffer.strip())
+                    if conversation_manager.queue_sentence(sentence_buffer):
                         return
-                    conversation_manager.conversation_history.append(f"Ollama: {sentence_buffer}")
             else:
-                data = response.json()
-                if 'response' in data:
-                    sentences = re.split('(?<=[.!?]) +', data['response'])
-                    for sentence in sentences:
-                        if sentence:
-                            if conversation_manager.speak_sentence(sentence):
-                                return
-                            conversation_manager.conversation_history.append(f"Ollama: {sentence}")
+                for sentence in split_sentences(self.handle_response_data(response.json(), conversation_manager)):
+                    reply.append(sentence)
+                    if conversation_manager.queue_sentence(sentence):
+                        return
+            completed = not conversation_manager.finish_response()
         except requests.exceptions.RequestException as e:
             logging.error(f"Error sending request to Ollama API: {e}")
+            # Spoken, so the user is not left waiting in silence after the filler
+            if not conversation_manager.queue_sentence(conversation_manager.ERROR_RESPONSE):
+                conversation_manager.finish_response()
+        finally:
+            # The filler timer must not fire once the request has failed or been abandoned
+            conversation_manager.speech_pipeline.cancel_filler()
+            self.finish_turn(text, " ".join(reply), conversation_manager, cacheable and completed, embedding)
+
+    def respond_from_cache(self, cached_response, conversation_manager):
+        # Straight to the speech pipeline; no request and no filler
+        conversation_manager.start_response(filler=False)
+        for sentence in split_sentences(cached_response):
+            if conversation_manager.queue_sentence(sentence):
+                break
+        else:
+            conversation_manager.finish_response()
+
+    # The steps below are shared with the async runtime, which does its own streaming and playback
+
+    def lookup_cached_response(self, text, conversation_manager):
+        # Returns (cacheable, cached response, embedding); the embedding is handed back to finish_turn() to store
+        conversation_manager.check_history_timeout()
+        # Only opening questions are cached: later ones may depend on the conversation in ways no word list can tell
+        cacheable = (self.response_cache is not None and not conversation_manager.has_history()
+                     and self.response_cache.cacheable(text))
+        if not cacheable:
+            return False, None, None
+        cached_response, embedding = self.response_cache.lookup(text)
+        if cached_response:
+            logging.info("Answering from the response cache.")
+            metrics.record('cache_hit', 1)
+            conversation_manager.add_user_message(text)
+            conversation_manager.add_assistant_message(cached_response)
+        return True, cached_response, embedding
+
+    def handle_response_data(self, data, conversation_manager):
+        # Returns the text in one response object; the final one also carries the context and generation stats
+        if self.config.verbose:
+            logging.info(f"Streamed JSON data: {data}")
+        token = self.response_text(data)
+        if token:
+            metrics.record_since('time_to_first_token', 'request')
+        if data.get("done", False):
+            conversation_manager.generate_context = data.get("context", conversation_manager.generate_context)
+            self.record_generation_stats(data)
+        return token
+
+    def finish_turn(self, text, reply, conversation_manager, store, embedding=None):
+        # One assistant message per turn, holding whatever was actually handed to the speech pipeline
+        if reply:
+            conversation_manager.add_assistant_message(reply)
+            if store:
+                self.response_cache.store(text, reply, embedding)
+        conversation_manager.memory.compact(self.summarize)
+
+    def embed(self, text):
+        payload = {"model": self.config.response_cache_embedding_model, "prompt": text, "keep_alive": self.config.ollama_keep_alive}
+        return self.post("/api/embeddings", payload).json()["embedding"]
+
+    def record_generation_stats(self, data):
+        # Ollama reports durations in nanoseconds
+        if data.get("eval_count") and data.get("eval_duration"):
+            metrics.record('tokens_per_second', data["eval_count"] / (data["eval_duration"] / 1e9))
+        if data.get("prompt_eval_duration"):
+            metrics.record('prompt_eval', data["prompt_eval_duration"] / 1e9)
+
+    def summarize(self, summary, transcript):
+        prompt = "Summarize this conversation in a few sentences, keeping names, facts and open questions.\n"
+        if summary:
+            prompt += f"Summary so far: {summary}\n"
+        payload = {
+            "model": self.config.language_model,
+            "prompt": f"{prompt}Conversation:\n{transcript}",
+            "stream": False,
+            "keep_alive": self.config.ollama_keep_alive,
+            "options": {"temperature": 0.0, "num_predict": 200},
+        }
+        return self.post("/api/generate", payload).json()["response"].strip()
@@ -0,0 +1,98 @@
+# response_cache.py
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import numpy as np
+
+# Utterances with these words usually refer back to the conversation, so their answers are not reusable
+HISTORY_WORDS = {
+    "it", "its", "that", "this", "these", "those", "they", "them", "their", "he", "him", "his", "she", "her",
+    "again", "more", "else", "also", "too", "previous", "earlier", "before", "last", "above", "same", "instead",
+}
+
+# "it" without an antecedent, as in "what time is it", does not refer back to anything
+DUMMY_IT = re.compile(r"\b(?:what (?:time|day|date)|how (?:cold|hot|warm|late|early)) is it\b")
+
+def normalize(text):
+    return " ".join(re.findall(r"[a-z0-9']+", text.lower()))
+
+class ResponseCache:
+    """SQLite backed cache of spoken responses keyed by the normalized transcript.
+
+    With an embedding function, a question that is worded differently but close enough to a cached
+    one (cosine similarity at or above similarity_threshold) is also a hit. Entries expire after
+    ttl seconds and the least recently used are evicted beyond max_entries. Entries are scoped by
+    namespace, so answers given under another model or system prompt are never reused.
+    """
+
+    def __init__(self, path, ttl, max_entries, embed=None, similarity_threshold=0.92, namespace=""):
+        self.namespace = hashlib.sha256(namespace.encode()).hexdigest()[:16]
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (namespace TEXT NOT NULL, key TEXT NOT NULL, response TEXT NOT NULL, "
+            "embedding BLOB, created REAL NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        self.connection.commit()
+
+    def cacheable(self, text):
+        normalized = normalize(text)
+        return bool(normalized) and not HISTORY_WORDS.intersection(DUMMY_IT.sub("", normalized).split())
+
+    def lookup(self, text):
+        # Returns (response, embedding); the embedding is passed back to store() so it is only computed once
+        key = normalize(text)
+        now = time.time()
+        # The connection as a context manager commits on exit, so the expiry delete is kept on a miss too
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            row = self.connection.execute(
+                "SELECT response FROM responses WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+            if row:
+                self.touch(key, now)
+                return row[0], None
+        if self.embed is None:
+            return None, None
+        try:
+            embedding = np.asarray(self.embed(text), dtype=np.float32)
+        except Exception as e:
+            logging.warning(f"Could not embed text for the response cache: {e}")
+            return None, None
+        with self.lock, self.connection:
+            rows = self.connection.execute(
+                "SELECT key, response, embedding FROM responses WHERE namespace = ? AND embedding IS NOT NULL", (self.namespace,)
+            ).fetchall()
+            if not rows:
+                return None, embedding
+            matrix = np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+            similarity = matrix @ embedding / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(embedding) + 1e-9)
+            best = int(np.argmax(similarity))
+            if similarity[best] < self.similarity_threshold:
+                return None, embedding
+            logging.debug(f"Response cache matched '{rows[best][0]}' with similarity {similarity[best]:.3f}.")
+            self.touch(rows[best][0], now)
+            return rows[best][1], embedding
+
+    def touch(self, key, now):
+        self.connection.execute("UPDATE responses SET last_used = ? WHERE namespace = ? AND key = ?", (now, self.namespace, key))
+
+    def store(self, text, response, embedding=None):
+        now = time.time()
+        blob = embedding.astype(np.float32).tobytes() if embedding is not None else None
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (namespace, key, response, embedding, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, normalize(text), response, blob, now, now),
+            )
+            self.connection.execute(
+                "DELETE FROM responses WHERE rowid NOT IN (SELECT rowid FROM responses ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
@@ -0,0 +1,251 @@
+# runtime.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import logging
+import random
+import threading
+import time
+import aiohttp
+from async_ollama_client import AsyncOllamaClient
+from metrics import metrics
+from ollama_client import split_sentences
+
+# Each mode is a pipeline of stages run by the listener task; responding and playback always run alongside
+PIPELINES = {
+    'keyword': ('wake_word', 'capture'),
+    'conversation': ('capture',),
+}
+
+GOODBYE_PHRASES = ["goodbye", "goodbye assistant"]
+
+class AsyncRuntime:
+    """asyncio runtime where listening, responding and playback are concurrent tasks connected by queues.
+
+    Capture and ASR run on their own thread pool, so the assistant keeps listening while it speaks.
+    A wake word, or in conversation mode a new utterance when barge_in is enabled, cancels the
+    response in progress: queued sentences are dropped and the sentence being spoken is stopped.
+    """
+
+    def __init__(self, config, speech_recognizer, keyword_detector, conversation_manager, ollama_client, command_router,
+                 capture=None):
+        self.config = config
+        self.stages = PIPELINES[config.mode]
+        self.speech_recognizer = speech_recognizer
+        self.keyword_detector = keyword_detector
+        self.conversation_manager = conversation_manager
+        self.ollama_client = ollama_client
+        self.command_router = command_router
+        self.capture = capture
+        self.async_client = AsyncOllamaClient(config)
+        self.listen_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='listen')
+        self.worker_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='worker')
+        # Queues and the idle event are created in run(): before Python 3.10 they bind to the loop current at creation
+        self.utterances = None
+        self.sentences = None
+        self.idle = None
+        self.response_task = None
+        self.current_playback = None
+        self.filler_playback = None
+        # stop_filler() bumps the generation under the lock, so a filler still being started is never left playing
+        self.filler_lock = threading.Lock()
+        self.filler_generation = 0
+
+    async def in_thread(self, function, *args, executor=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor or self.worker_executor, functools.partial(function, *args))
+
+    async def run(self):
+        self.utterances = asyncio.Queue()
+        self.sentences = asyncio.Queue(maxsize=self.config.tts_queue_size)
+        # Set while nothing is being answered; without barge-in, conversation mode waits for it before listening again
+        self.idle = asyncio.Event()
+        self.idle.set()
+        responder = asyncio.create_task(self.respond_loop())
+        playback = asyncio.create_task(self.playback_loop())
+        # Loads the language model while the listener starts, and opens the connection the first answer will reuse
+        warm_up = asyncio.create_task(self.async_client.warm_up())
+        try:
+            await self.listen_loop()
+        finally:
+            responder.cancel()
+            playback.cancel()
+            warm_up.cancel()
+            self.stop_listening()
+            for playback_handle in (self.current_playback, self.filler_playback):
+                if playback_handle is not None and playback_handle.poll() is None:
+                    playback_handle.kill()
+            await self.async_client.close()
+            self.listen_executor.shutdown(wait=False)
+            self.worker_executor.shutdown(wait=False)
+
+    def stop_listening(self):
+        # Unblocks the listen thread, which would otherwise keep the process alive waiting on the microphone
+        self.speech_recognizer.stop()
+        if self.keyword_detector is not None:
+            self.keyword_detector.stop()
+        if self.capture is not None:
+            self.capture.stop()
+
+    async def listen_loop(self):
+        while True:
+            if 'wake_word' not in self.stages and not self.config.barge_in:
+                await self.idle.wait()
+            start_frame = None
+            carried = {"spans": [], "marks": {}}
+            if 'wake_word' in self.stages:
+                detected = await self.in_thread(self.detached, carried, self.keyword_detector.listen_for_keyword,
+                                                self.conversation_manager, False, executor=self.listen_executor)
+                if not detected:
+                    continue
+                await self.barge_in()
+                await self.in_thread(self.conversation_manager.greet_user)
+                self.keyword_detector.mark_speech_start()
+                start_frame = self.keyword_detector.detection_frame
+            text = await self.in_thread(self.detached, carried, self.speech_recognizer.listen_for_speech, start_frame,
+                                        executor=self.listen_executor)
+            if not text:
+                continue
+            if text in GOODBYE_PHRASES:
+                await self.barge_in()
+                await self.in_thread(self.conversation_manager.say_goodbye)
+                return
+            if self.config.barge_in:
+                await self.barge_in()
+            self.idle.clear()
+            # The listener's spans and its endpoint mark travel with the text and open the turn in respond()
+            await self.utterances.put((text, carried))
+
+    @staticmethod
+    def detached(carried, function, *args):
+        # Runs on the listen thread, which overlaps the turn being answered
+        with metrics.detached() as collected:
+            result = function(*args)
+        carried["spans"].extend(collected["spans"])
+        carried["marks"].update(collected["marks"])
+        return result
+
+    async def barge_in(self):
+        if self.response_task is not None and not self.response_task.done():
+            logging.info("Interrupted by user. Stopping the current response...")
+            self.response_task.cancel()
+        while not self.sentences.empty():
+            self.sentences.get_nowait()
+            self.sentences.task_done()
+        for playback in (self.current_playback, self.filler_playback):
+            if playback is not None and playback.poll() is None:
+                playback.kill()
+
+    async def respond_loop(self):
+        while True:
+            text, carried = await self.utterances.get()
+            self.response_task = asyncio.create_task(self.respond(text, carried))
+            # wait() rather than awaiting the task, so a cancelled response does not cancel this loop
+            await asyncio.wait({self.response_task})
+            if not self.response_task.cancelled() and self.response_task.exception():
+                logging.error(f"Error while responding: {self.response_task.exception()}")
+            if self.utterances.empty():
+                self.idle.set()
+
+    async def respond(self, text, carried):
+        metrics.start_turn(carried)
+        try:
+            await self.answer(text)
+        finally:
+            metrics.end_turn()
+
+    async def answer(self, text):
+        with metrics.span('extension_dispatch'):
+            handled = await self.in_thread(self.command_router.dispatch, text, self.conversation_manager, self.ollama_client)
+        if handled:
+            return
+        conversation_manager = self.conversation_manager
+        ollama_client = self.ollama_client
+        cacheable, cached_response, embedding = await self.in_thread(ollama_client.lookup_cached_response, text,
+                                                                     conversation_manager)
+        if cached_response:
+            for sentence in split_sentences(cached_response):
+                await self.sentences.put(sentence)
+            await self.sentences.join()
+            return
+
+        conversation_manager.add_user_message(text)
+        payload = ollama_client.build_payload(conversation_manager, text, True)
+        logging.info("Sending text to language model for processing...")
+        filler = asyncio.create_task(self.play_filler(self.filler_generation))
+        reply = []
+        completed = False
+        try:
+            metrics.mark('request')
+            sentence_buffer = ""
+            stream = self.async_client.stream(f"/api/{self.config.ollama_api}", payload)
+            try:
+                async for data in stream:
+                    sentence_buffer += ollama_client.handle_response_data(data, conversation_manager)
+                    if any(sentence_buffer.endswith(punc) for punc in '.!?') and sentence_buffer.strip():
+                        await self.stop_filler(filler)
+                        reply.append(sentence_buffer.strip())
+                        await self.sentences.put(sentence_buffer)
+                        sentence_buffer = ""
+            finally:
+                # Closes the HTTP response right away when the response is cancelled
+                await stream.aclose()
+            if sentence_buffer.strip():
+                await self.stop_filler(filler)
+                reply.append(sentence_buffer.strip())
+                await self.sentences.put(sentence_buffer)
+            await self.sentences.join()
+            conversation_manager.update_last_interaction_time()
+            completed = True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"Error sending request to Ollama API: {e}")
+            # Spoken, as in the sync client, so the user is not left waiting in silence after the filler
+            await self.stop_filler(filler)
+            await self.sentences.put(conversation_manager.ERROR_RESPONSE)
+            await self.sentences.join()
+        finally:
+            await self.stop_filler(filler)
+            await self.in_thread(ollama_client.finish_turn, text, " ".join(reply), conversation_manager,
+                                 cacheable and completed, embedding)
+
+    async def play_filler(self, generation):
+        if self.config.filler_delay is None:
+            return
+        await asyncio.sleep(self.config.filler_delay)
+        response = random.choice(self.conversation_manager.PROCESSING_RESPONSES)
+        playback = await self.in_thread(self.start_filler, response, generation)
+        if playback is not None:
+            await self.in_thread(playback.wait)
+
+    def start_filler(self, response, generation):
+        # Runs on a worker thread, so cancelling play_filler() does not stop it once it has begun
+        with self.filler_lock:
+            if generation != self.filler_generation:
+                return None
+            self.filler_playback = self.conversation_manager.tts_engine.start(response)
+            return self.filler_playback
+
+    async def stop_filler(self, filler):
+        filler.cancel()
+        # Cancelling the task does not stop audio already handed to the engine
+        with self.filler_lock:
+            self.filler_generation += 1
+            playback, self.filler_playback = self.filler_playback, None
+        if playback is not None and playback.poll() is None:
+            playback.kill()
+
+    async def playback_loop(self):
+        tts_engine = self.conversation_manager.tts_engine
+        while True:
+            sentence = await self.sentences.get()
+            try:
+                start_time = time.perf_counter()
+                self.current_playback = await self.in_thread(tts_engine.start, sentence)
+                metrics.record_since('time_to_first_audio', 'endpoint')
+                await self.in_thread(self.current_playback.wait)
+                metrics.record('tts_sentence', time.perf_counter() - start_time)
+            except Exception as e:
+                logging.error(f"Error speaking sentence: {e}")
+            finally:
+                self.current_playback = None
+                self.sentences.task_done()
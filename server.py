@@ -0,0 +1,243 @@
+# server.py
+# Serves several rooms or devices from one process. Each client connects over TCP and streams raw 16 kHz mono
+# 16-bit PCM; the server sends back newline delimited JSON events. One Whisper model is shared by all sessions and
+# transcription requests are batched across them, while each session keeps its own conversation state and all of
+# them share the pooled Ollama client.
+#
+# Events sent to the client:
+#   {"type": "transcript", "text": ...}  what the user said
+#   {"type": "sentence", "text": ...}    a sentence of the answer, for the client to speak
+#   {"type": "done"}                     the answer is complete
+#   {"type": "goodbye"}                  the user said goodbye; the server closes the connection
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import queue
+import threading
+import numpy as np
+import torch
+import whisper
+from config import Config, load_config, merge_config_and_args
+from conversation_manager import ConversationManager
+from command_router import CommandRouter
+from endpointer import EnergyEndpointer
+from metrics import metrics
+from ollama_client import OllamaClient
+from tts_engine import TTSEngine, FinishedPlayback
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+FRAME_LENGTH = 512
+GOODBYE_PHRASES = ["goodbye", "goodbye assistant"]
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Multi-session LVChat server streaming raw PCM over TCP.")
+    parser.add_argument('--config', type=str, default='config.yaml', help='Path to the configuration file')
+    parser.add_argument('--server-host', type=str, help='Address to listen on')
+    parser.add_argument('--server-port', type=int, help='Port to listen on')
+    parser.add_argument('--whisper-model', type=str, choices=['tiny', 'base', 'small', 'medium', 'large'], help='Whisper model to use')
+    parser.add_argument('--asr-batch-size', type=int, help='Maximum number of utterances transcribed together')
+    parser.add_argument('--verbose', action='store_true', default=None, help='Enable debug logging')
+    return parser.parse_args()
+
+class BatchTranscriber:
+    """Shared Whisper model that decodes utterances from all sessions in batches.
+
+    Requests that arrive within batch_window seconds of each other are stacked into one mel batch
+    and decoded in a single pass, which keeps the CPU busy instead of decoding one session at a time.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.model = whisper.load_model(config.whisper_model)
+        logging.info(f"Whisper model '{config.whisper_model}' loaded.")
+        # Same test as whisper.transcribe(): likely silence and a low confidence decode means there was no speech
+        self.no_speech_threshold = 0.6
+        self.logprob_threshold = -1.0
+        self.options = whisper.DecodingOptions(
+            language=config.whisper_language,
+            fp16=self.model.device.type != 'cpu',
+            without_timestamps=True,
+        )
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    async def transcribe(self, pcm):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.requests.put((pcm, future, loop))
+        return await future
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            while len(batch) < self.config.asr_batch_size:
+                try:
+                    batch.append(self.requests.get(timeout=self.config.asr_batch_window))
+                except queue.Empty:
+                    break
+            try:
+                with metrics.span('asr_decode'):
+                    texts = self.decode([pcm for pcm, _, _ in batch])
+                metrics.record('asr_batch_size', len(batch))
+                for (_, future, loop), text in zip(batch, texts):
+                    loop.call_soon_threadsafe(future.set_result, text)
+            except Exception as e:
+                logging.error(f"Error transcribing batch: {e}")
+                for _, future, loop in batch:
+                    loop.call_soon_threadsafe(future.set_exception, e)
+
+    @torch.no_grad()
+    def decode(self, pcms):
+        mels = []
+        for pcm in pcms:
+            audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+            mels.append(whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=self.model.dims.n_mels))
+        results = whisper.decode(self.model, torch.stack(mels).to(self.model.device), self.options)
+        texts = []
+        for result in results:
+            if result.no_speech_prob > self.no_speech_threshold and result.avg_logprob < self.logprob_threshold:
+                texts.append("")
+            else:
+                texts.append(result.text.strip().lower())
+        return texts
+
+class SessionEngine(TTSEngine):
+    """Sends sentences to the client to speak instead of playing them on the server."""
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+
+    def start(self, text):
+        self.session.send_threadsafe({"type": "sentence", "text": text})
+        return FinishedPlayback()
+
+class Session:
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.peer = writer.get_extra_info('peername')
+        self.conversation_manager = ConversationManager(server.config, SessionEngine(self))
+        self.endpointer = EnergyEndpointer(
+            SAMPLE_RATE,
+            SAMPLE_WIDTH,
+            FRAME_LENGTH,
+            pause_threshold=server.config.pause_threshold,
+            max_duration=server.config.speech_timeout,
+        )
+        self.utterances = asyncio.Queue()
+
+    def send(self, event):
+        if not self.writer.is_closing():
+            self.writer.write(json.dumps(event).encode() + b"\n")
+
+    def send_threadsafe(self, event):
+        self.loop.call_soon_threadsafe(self.send, event)
+
+    async def run(self):
+        logging.info(f"Session {self.peer} connected.")
+        responder = asyncio.create_task(self.respond_loop())
+        try:
+            while not responder.done():
+                frame = await self.reader.readexactly(FRAME_LENGTH * SAMPLE_WIDTH)
+                segment = self.endpointer.process(frame)
+                if segment is not None:
+                    # Sessions overlap, so each keeps its spans apart and writes them as one turn per answer
+                    with metrics.detached() as carried:
+                        metrics.mark('endpoint')
+                        metrics.record('capture', self.endpointer.last_duration)
+                        metrics.record('endpoint', self.endpointer.last_trailing_silence)
+                    await self.utterances.put((segment, carried))
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            responder.cancel()
+            self.conversation_manager.close()
+            self.writer.close()
+            logging.info(f"Session {self.peer} disconnected.")
+
+    async def respond_loop(self):
+        # Utterances of one session are answered in order; sessions run independently of each other
+        try:
+            while True:
+                segment, carried = await self.utterances.get()
+                text = await self.server.transcriber.transcribe(segment)
+                if not text:
+                    continue
+                logging.info(f"Session {self.peer} said: {text}")
+                self.send({"type": "transcript", "text": text})
+                if text in GOODBYE_PHRASES:
+                    self.send({"type": "goodbye"})
+                    await self.writer.drain()
+                    # Also ends the read loop in run(), which frees the session slot
+                    self.writer.close()
+                    return
+                collected = await self.loop.run_in_executor(self.server.executor, self.server.handle_text, text,
+                                                            self.conversation_manager)
+                carried["spans"].extend(collected["spans"])
+                carried["marks"].update(collected["marks"])
+                metrics.record_turn(carried)
+                self.send({"type": "done"})
+                await self.writer.drain()
+        except Exception as e:
+            # Closing the connection also ends the read loop in run()
+            logging.error(f"Error in session {self.peer}: {e}")
+            self.writer.close()
+
+class Server:
+    def __init__(self, config, merged_config):
+        self.config = config
+        self.transcriber = BatchTranscriber(config)
+        self.ollama_client = OllamaClient(config)
+        self.command_router = CommandRouter('extensions', merged_config, config.command_fuzzy_cutoff)
+        self.executor = ThreadPoolExecutor(max_workers=config.server_max_sessions)
+        self.sessions = set()
+
+    def handle_text(self, text, conversation_manager):
+        # Runs on an executor thread; returns the spans recorded while answering
+        with metrics.detached() as collected:
+            with metrics.span('extension_dispatch'):
+                handled = self.command_router.dispatch(text, conversation_manager, self.ollama_client)
+            if not handled:
+                self.ollama_client.send_to_ollama_and_respond(text, conversation_manager)
+        return collected
+
+    async def handle_client(self, reader, writer):
+        if len(self.sessions) >= self.config.server_max_sessions:
+            logging.warning("Refusing connection: too many sessions.")
+            writer.close()
+            return
+        session = Session(self, reader, writer)
+        self.sessions.add(session)
+        try:
+            await session.run()
+        finally:
+            self.sessions.discard(session)
+
+    async def serve(self):
+        self.ollama_client.warm_up()
+        server = await asyncio.start_server(self.handle_client, self.config.server_host, self.config.server_port)
+        logging.info(f"Listening for sessions on {self.config.server_host}:{self.config.server_port}")
+        async with server:
+            await server.serve_forever()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_arguments()
+    config_data = load_config(args.config) if os.path.exists(args.config) else {}
+    merged_config = merge_config_and_args(config_data, args, args.config)
+    config = Config(merged_config)
+    if config.verbose or args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+    metrics.configure(config)
+    asyncio.run(Server(config, merged_config).serve())
+
+if __name__ == "__main__":
+    main()
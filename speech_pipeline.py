@@ -0,0 +1,122 @@
+# speech_pipeline.py
+import logging
+import queue
+import threading
+import time
+from metrics import metrics
+
+class SpeechPipeline:
+    """Speaks queued sentences on a dedicated playback worker.
+
+    The response stream keeps producing sentences while earlier ones are being spoken.
+    cancel() handles barge-in: it drops everything still queued and stops the sentence being spoken.
+    A filler phrase can be scheduled to cover the wait for the first sentence; it is skipped or cut
+    short as soon as real speech is ready.
+    """
+
+    def __init__(self, conversation_manager, max_queue):
+        self.conversation_manager = conversation_manager
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.interrupted = threading.Event()
+        self.process_lock = threading.Lock()
+        self.current_process = None
+        self.filler_timer = None
+        self.filler_process = None
+        self.sentence_started = False
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def reset(self):
+        self.interrupted.clear()
+        self.sentence_started = False
+
+    def schedule_filler(self, text, delay):
+        self.filler_timer = threading.Timer(delay, self.play_filler, args=(text,))
+        self.filler_timer.daemon = True
+        self.filler_timer.start()
+
+    def play_filler(self, text):
+        with self.process_lock:
+            if self.interrupted.is_set() or self.sentence_started:
+                return
+            self.filler_process = self.conversation_manager.tts_engine.start(text)
+
+    def cancel_filler(self):
+        if self.filler_timer is not None:
+            self.filler_timer.cancel()
+            self.filler_timer = None
+        with self.process_lock:
+            filler_process, self.filler_process = self.filler_process, None
+        if filler_process is not None:
+            if filler_process.poll() is None:
+                filler_process.kill()
+            filler_process.wait()
+
+    def put(self, sentence):
+        # Blocks while the queue is full so the producer cannot run arbitrarily far ahead of playback
+        while not self.interrupted.is_set():
+            try:
+                self.queue.put(sentence, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def wait(self):
+        self.queue.join()
+        with self.process_lock:
+            self.sentence_started = True
+        self.cancel_filler()
+        return self.interrupted.is_set()
+
+    def cancel(self):
+        self.interrupted.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+            except queue.Empty:
+                break
+        with self.process_lock:
+            if self.current_process and self.current_process.poll() is None:
+                self.current_process.kill()
+        self.cancel_filler()
+
+    def close(self):
+        # Stops whatever is playing and ends the worker; used when the conversation itself goes away
+        self.cancel()
+        self.queue.put(None)
+
+    def run(self):
+        while True:
+            sentence = self.queue.get()
+            if sentence is None:
+                self.queue.task_done()
+                return
+            try:
+                if not self.interrupted.is_set():
+                    self.speak(sentence)
+            except Exception as e:
+                logging.error(f"Error speaking sentence: {e}")
+            finally:
+                self.queue.task_done()
+
+    def speak(self, sentence):
+        with self.process_lock:
+            self.sentence_started = True
+        self.cancel_filler()
+        start_time = time.perf_counter()
+        with self.process_lock:
+            self.current_process = self.conversation_manager.tts_engine.start(sentence)
+        metrics.record_since('time_to_first_audio', 'endpoint')
+        process = self.current_process
+        # The spacebar check blocks for up to 0.1s, which doubles as the poll interval
+        while process.poll() is None:
+            if self.conversation_manager.check_for_spacebar_input_non_blocking():
+                logging.info("Interrupted by user while speaking. Listening for keyword...")
+                self.cancel()
+                break
+        process.wait()
+        metrics.record('tts_sentence', time.perf_counter() - start_time)
+        with self.process_lock:
+            self.current_process = None
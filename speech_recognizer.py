@@ -1,50 +1,221 @@
 import speech_recognition as sr
-import io
-import tempfile
 import logging
-import whisper
+import numpy as np
 import threading
+from audio_capture import MicrophoneStream, CaptureReader
+from endpointer import EnergyEndpointer
+from streaming_transcriber import StreamingTranscriber
+from metrics import metrics
+
+WHISPER_SAMPLE_RATE = 16000
 
 class SpeechRecognizer:
-    def __init__(self, config):
+    def __init__(self, config, capture=None):
         self.config = config
         self.recognizer = sr.Recognizer()
         self.recognizer.pause_threshold = config.pause_threshold
+        self.model = None
+        self.model_error = None
+        self.model_error_reported = False
+        self.model_ready = threading.Event()
+        # Whisper hooks its KV cache onto the shared decoder for each decode, so every user of the model takes this lock
+        self.model_lock = threading.Lock()
+        self.streaming_transcriber = None
+        self.audio_buffer = np.zeros(0, dtype=np.float32)
+        self.microphone_stream = None
+        if capture is not None:
+            self.microphone_stream = capture.reader()
+        elif config.streaming_capture:
+            self.microphone_stream = MicrophoneStream().open()
+        if self.microphone_stream is not None:
+            self.endpointer = EnergyEndpointer(
+                self.microphone_stream.sample_rate,
+                self.microphone_stream.sample_width,
+                self.microphone_stream.frame_length,
+                pause_threshold=config.pause_threshold,
+                max_duration=config.speech_timeout,
+            )
+        if config.streaming_transcription and not (config.use_whisper and self.microphone_stream is not None):
+            logging.warning("streaming_transcription requires use_whisper and streaming_capture. Transcribing after capture instead.")
         if config.use_whisper:
-            self.model = whisper.load_model(config.whisper_model)
-            logging.info(f"Whisper model '{config.whisper_model}' loaded.")
+            if config.background_model_load:
+                # Listening can start right away; only the first transcription waits for the model
+                threading.Thread(target=self.load_model, daemon=True).start()
+            else:
+                self.load_model()
+
+    def load_model(self):
+        try:
+            import whisper
+            self.model = whisper.load_model(self.config.whisper_model)
+            logging.info(f"Whisper model '{self.config.whisper_model}' loaded.")
+            # fp16 is not supported on CPU and whisper only warns and falls back on every call
+            self.decode_options = {
+                'language': self.config.whisper_language,
+                'fp16': self.model.device.type != 'cpu',
+            }
+            if self.config.streaming_transcription and self.microphone_stream is not None:
+                self.streaming_transcriber = StreamingTranscriber(
+                    self.model,
+                    self.decode_options,
+                    self.model_lock,
+                    sample_rate=self.microphone_stream.sample_rate,
+                    interval=self.config.partial_interval,
+                )
+        except Exception as e:
+            logging.error(f"Could not load Whisper model '{self.config.whisper_model}': {e}")
+            self.model_error = e
+        finally:
+            self.model_ready.set()
+
+    def get_model(self):
+        if not self.model_ready.is_set():
+            logging.info("Waiting for the Whisper model to finish loading...")
+            self.model_ready.wait()
+        if self.model_error is not None:
+            raise RuntimeError(f"Whisper model is not available: {self.model_error}")
+        return self.model
+
+    def whisper_available(self):
+        # A failed background load falls back to the Google recognizer instead of crashing the listen loop
+        try:
+            self.get_model()
+            return True
+        except RuntimeError as e:
+            if not self.model_error_reported:
+                logging.error(f"{e}. Using Google speech recognition instead.")
+                self.model_error_reported = True
+            return False
 
-    def listen_for_speech(self):  # Remove conversation_manager as a parameter
+    def listen_for_speech(self, start_frame=None):
+        # start_frame is the capture frame where the wake word ended, so nothing said right after it is lost
         logging.info("Listening for speech...")
-        if self.config.use_whisper:
+        if isinstance(self.microphone_stream, CaptureReader):
+            if start_frame is None:
+                self.microphone_stream.seek_live()
+            else:
+                self.microphone_stream.seek(start_frame)
+        if (self.streaming_transcriber is None and self.config.streaming_transcription and self.config.use_whisper
+                and self.microphone_stream is not None and not self.model_ready.is_set()):
+            logging.info("Whisper model is still loading. Transcribing this utterance after capture instead of while it is spoken.")
+        if self.streaming_transcriber:
+            audio_text = self.capture_and_transcribe()
+            if audio_text is not None:
+                logging.info(f"User said: {audio_text}")
+            return audio_text
+        if self.microphone_stream is not None:
+            audio_data = self.capture_utterance()
+            if audio_data is None:
+                return None
+            if self.config.use_whisper and self.whisper_available():
+                audio_text = self.transcribe_with_whisper(audio_data)
+                logging.info(f"User said: {audio_text}")
+                return audio_text
+            return self.recognize_google(audio_data)
+        if self.config.use_whisper and self.whisper_available():
             with sr.Microphone() as mic:
                 self.recognizer.adjust_for_ambient_noise(mic, duration=0.5)
-                audio_data = self.recognizer.record(mic, duration=self.config.speech_timeout)
-                audio_buffer = io.BytesIO(audio_data.get_wav_data())
-                audio_text = self.transcribe_with_whisper(audio_buffer)
+                with metrics.span('capture'):
+                    audio_data = self.recognizer.record(mic, duration=self.config.speech_timeout)
+                metrics.mark('endpoint')
+                audio_text = self.transcribe_with_whisper(audio_data)
                 logging.info(f"User said: {audio_text}")
                 return audio_text
         else:
             try:
                 with sr.Microphone() as source:
-                    audio_data = self.recognizer.listen(source, timeout=self.config.speech_timeout)
-                    text = self.recognizer.recognize_google(audio_data).lower()
-                    logging.info(f"User said: {text}")
-                    return text
+                    with metrics.span('capture'):
+                        audio_data = self.recognizer.listen(source, timeout=self.config.speech_timeout)
+                metrics.mark('endpoint')
             except sr.WaitTimeoutError:
                 logging.warning("Listening timed out while waiting for speech to start.")
                 return None
-            except sr.UnknownValueError:
-                logging.warning("Could not understand audio.")
-                return None
-            except sr.RequestError as e:
-                logging.error(f"Could not request results; {e}")
-                return None
+            return self.recognize_google(audio_data)
+
+    def stop(self):
+        # Lets a listen blocked on a microphone stream of its own return, so the process can exit
+        if isinstance(self.microphone_stream, MicrophoneStream):
+            self.microphone_stream.stop()
+
+    def capture_utterance(self):
+        # Reads from the already open stream; the endpointer hands back the utterance as soon as
+        # the speaker pauses instead of waiting out the full speech_timeout.
+        stream = self.microphone_stream
+        frame_seconds = stream.frame_length / stream.sample_rate
+        waited = 0.0
+        self.endpointer.reset()
+        while True:
+            segment = self.endpointer.process(stream.read_frame())
+            if segment is not None:
+                self.record_endpoint()
+                return sr.AudioData(segment, stream.sample_rate, stream.sample_width)
+            if not self.endpointer.in_speech:
+                waited += frame_seconds
+                if waited >= self.config.speech_timeout:
+                    logging.warning("Listening timed out while waiting for speech to start.")
+                    return None
+
+    def capture_and_transcribe(self):
+        # Same loop as capture_utterance, but frames are also fed to the streaming transcriber from the
+        # moment speech starts, so most of the decode is done by the time the speaker pauses.
+        stream = self.microphone_stream
+        frame_seconds = stream.frame_length / stream.sample_rate
+        waited = 0.0
+        self.endpointer.reset()
+        while True:
+            frame = stream.read_frame()
+            was_in_speech = self.endpointer.in_speech
+            segment = self.endpointer.process(frame)
+            if self.endpointer.in_speech:
+                if was_in_speech:
+                    self.streaming_transcriber.feed(frame)
+                else:
+                    self.streaming_transcriber.start()
+                    self.streaming_transcriber.feed(b"".join(self.endpointer.frames))
+            elif segment is not None:
+                self.record_endpoint()
+                self.streaming_transcriber.feed(frame)
+                with metrics.span('asr_decode'):
+                    return self.streaming_transcriber.finish(self.endpointer.last_trailing_silence)
+            else:
+                waited += frame_seconds
+                if waited >= self.config.speech_timeout:
+                    logging.warning("Listening timed out while waiting for speech to start.")
+                    return None
+
+    def record_endpoint(self):
+        metrics.mark('endpoint')
+        metrics.record('capture', self.endpointer.last_duration)
+        metrics.record('endpoint', self.endpointer.last_trailing_silence)
+
+    def recognize_google(self, audio_data):
+        try:
+            with metrics.span('asr_decode'):
+                text = self.recognizer.recognize_google(audio_data).lower()
+            logging.info(f"User said: {text}")
+            return text
+        except sr.UnknownValueError:
+            logging.warning("Could not understand audio.")
+            return None
+        except sr.RequestError as e:
+            logging.error(f"Could not request results; {e}")
+            return None
+
+    def audio_data_to_array(self, audio_data):
+        # Resample to whisper's rate as 16-bit PCM and scale into the reused float32 buffer,
+        # so no WAV container, temp file or ffmpeg decode is involved.
+        raw = audio_data.get_raw_data(convert_rate=WHISPER_SAMPLE_RATE, convert_width=2)
+        samples = np.frombuffer(raw, dtype=np.int16)
+        if self.audio_buffer.shape[0] < samples.shape[0]:
+            self.audio_buffer = np.empty(samples.shape[0], dtype=np.float32)
+        audio = self.audio_buffer[:samples.shape[0]]
+        np.multiply(samples, 1.0 / 32768.0, out=audio, casting='unsafe')
+        return audio
 
-    def transcribe_with_whisper(self, audio_buffer):
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=True) as tmpfile:
-            audio_buffer.seek(0)
-            tmpfile.write(audio_buffer.read())
-            tmpfile.flush()
-            result = self.model.transcribe(tmpfile.name)
+    def transcribe_with_whisper(self, audio_data):
+        self.get_model()
+        with metrics.span('asr_decode'):
+            audio = self.audio_data_to_array(audio_data)
+            with self.model_lock:
+                result = self.model.transcribe(audio, **self.decode_options)
         return result["text"].lower()
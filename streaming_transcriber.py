@@ -0,0 +1,122 @@
+# streaming_transcriber.py
+import logging
+import threading
+import numpy as np
+
+class StreamingTranscriber:
+    """Runs Whisper over the audio of an utterance while it is still being spoken.
+
+    A background worker repeatedly decodes the audio captured since the last committed point.
+    Segments that end more than commit_margin before the end of the decoded audio are treated as
+    stable and committed. When the endpoint fires, finish() reuses the latest decode if only the
+    trailing silence came after it, and otherwise decodes just the short uncommitted tail.
+    """
+
+    def __init__(self, model, decode_options, model_lock, sample_rate=16000, interval=0.5, commit_margin=1.0):
+        self.model = model
+        self.decode_options = decode_options
+        # Shared with every other user of the model; a decode left over from the previous utterance holds it too
+        self.model_lock = model_lock
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.commit_margin = commit_margin
+        self.lock = threading.Lock()
+        # Notified whenever a background decode finishes
+        self.decoded = threading.Condition(self.lock)
+        self.stop_event = threading.Event()
+        self.worker = None
+        # Each utterance gets a new run_id, so a decode left over from the previous one cannot commit into it
+        self.run_id = 0
+        self.reset()
+
+    def reset(self):
+        self.audio = bytearray()
+        self.committed_bytes = 0
+        self.committed_text = []
+        self.decoded_bytes = 0
+        # (start, end, text) of the uncommitted part of the latest decode, and (start, end) of the one running now
+        self.hypothesis = None
+        self.in_flight = None
+        self.finished = False
+
+    def start(self):
+        with self.lock:
+            self.stop_event.set()
+            self.reset()
+            self.run_id += 1
+            self.stop_event = threading.Event()
+        self.worker = threading.Thread(target=self.run, args=(self.run_id, self.stop_event), daemon=True)
+        self.worker.start()
+
+    def feed(self, frame):
+        with self.lock:
+            self.audio.extend(frame)
+
+    def run(self, run_id, stop_event):
+        min_new_bytes = int(self.interval * self.sample_rate) * 2
+        while not stop_event.wait(self.interval):
+            with self.lock:
+                if stop_event.is_set():
+                    return
+                if len(self.audio) - self.decoded_bytes < min_new_bytes:
+                    continue
+                start = self.committed_bytes
+                pending = bytes(self.audio[start:])
+                self.decoded_bytes = len(self.audio)
+                self.in_flight = (start, self.decoded_bytes)
+            result = None
+            try:
+                result = self.decode(pending)
+            except Exception as e:
+                logging.warning(f"Streaming decode failed: {e}")
+            self.commit_stable_segments(run_id, start, pending, result)
+
+    def commit_stable_segments(self, run_id, start, pending, result):
+        segments = result.get("segments", []) if result else []
+        stable_until = len(pending) / 2 / self.sample_rate - self.commit_margin
+        committed = [segment for segment in segments if segment["end"] <= stable_until]
+        with self.lock:
+            if run_id != self.run_id:
+                return
+            self.in_flight = None
+            self.decoded.notify_all()
+            if result is None or self.finished or start != self.committed_bytes:
+                return
+            if committed:
+                self.committed_text.extend(segment["text"].strip() for segment in committed)
+                self.committed_bytes = start + int(committed[-1]["end"] * self.sample_rate) * 2
+            uncommitted = " ".join(segment["text"].strip() for segment in segments[len(committed):])
+            self.hypothesis = (self.committed_bytes, start + len(pending), uncommitted)
+            partial = " ".join(self.committed_text + [uncommitted])
+        logging.debug(f"Partial transcript: {partial}")
+
+    def decode(self, pcm):
+        audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        prompt = " ".join(self.committed_text) or None
+        with self.model_lock:
+            return self.model.transcribe(audio, initial_prompt=prompt, **self.decode_options)
+
+    def covers_speech(self, span, silence_bytes):
+        # True when span starts at the committed point and only the trailing silence came after it
+        return span[0] == self.committed_bytes and len(self.audio) - span[1] <= silence_bytes
+
+    def finish(self, trailing_silence=0.0):
+        silence_bytes = int(trailing_silence * self.sample_rate) * 2
+        with self.lock:
+            self.stop_event.set()
+            # A decode already covering all the speech is worth waiting for; an older one is not used, and the tail
+            # decode below only queues behind it on the model lock
+            while self.in_flight is not None and self.covers_speech(self.in_flight, silence_bytes):
+                self.decoded.wait()
+            self.finished = True
+            tail = bytes(self.audio[self.committed_bytes:])
+            text = list(self.committed_text)
+            hypothesis = self.hypothesis
+            reuse = hypothesis is not None and self.covers_speech(hypothesis, silence_bytes)
+        self.worker = None
+        if reuse:
+            text.append(hypothesis[2])
+        # Anything under a tenth of a second is just the trailing edge of the pause
+        elif len(tail) >= self.sample_rate // 10 * 2:
+            text.append(self.decode(tail)["text"].strip())
+        return " ".join(part for part in text if part).lower()
@@ -0,0 +1,313 @@
+# tts_engine.py
+from collections import OrderedDict, deque
+import ctypes
+import ctypes.util
+import io
+import logging
+import platform
+import subprocess
+import threading
+import wave
+import numpy as np
+
+try:
+    import sounddevice as sd
+except ImportError:
+    sd = None
+
+class PcmPlayback:
+    """Plays rendered 16-bit mono PCM. Exposes poll/kill/wait like the Popen handle of the say engine.
+
+    With pcm=None the audio is still being synthesized: append() adds chunks while it plays and end()
+    marks it complete. Should playback catch up with synthesis, it plays silence until the next chunk.
+    """
+
+    def __init__(self, pcm, sample_rate):
+        if sd is None:
+            raise RuntimeError("sounddevice is required to play synthesized audio.")
+        self.pending = deque()
+        self.offset = 0
+        self.complete = pcm is not None
+        if pcm is not None:
+            self.pending.append(pcm)
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.stream = sd.OutputStream(samplerate=sample_rate, channels=1, dtype='int16',
+                                      callback=self.callback, finished_callback=self.finished.set)
+        self.stream.start()
+
+    def append(self, chunk):
+        with self.lock:
+            self.pending.append(chunk)
+
+    def end(self):
+        with self.lock:
+            self.complete = True
+
+    def callback(self, outdata, frames, time_info, status):
+        filled = 0
+        with self.lock:
+            while filled < frames and self.pending:
+                chunk = self.pending[0]
+                count = min(frames - filled, len(chunk) - self.offset)
+                outdata[filled:filled + count, 0] = chunk[self.offset:self.offset + count]
+                filled += count
+                self.offset += count
+                if self.offset == len(chunk):
+                    self.pending.popleft()
+                    self.offset = 0
+            complete = self.complete
+        outdata[filled:] = 0
+        if filled < frames and complete:
+            raise sd.CallbackStop
+
+    def poll(self):
+        return 0 if self.finished.is_set() else None
+
+    def kill(self):
+        self.stream.abort()
+        self.finished.set()
+
+    def wait(self):
+        self.finished.wait()
+        self.stream.close()
+        return 0
+
+class TTSEngine:
+    def __init__(self, voice=None):
+        self.voice = voice
+
+    def start(self, text):
+        raise NotImplementedError
+
+    def speak(self, text):
+        self.start(text).wait()
+
+    def preload(self, texts):
+        pass
+
+class FinishedPlayback:
+    def poll(self):
+        return 0
+
+    def kill(self):
+        pass
+
+    def wait(self):
+        return 0
+
+class NullEngine(TTSEngine):
+    """Discards speech. For headless runs and benchmarks."""
+
+    def start(self, text):
+        logging.debug(f"Not speaking: {text}")
+        return FinishedPlayback()
+
+class SayEngine(TTSEngine):
+    """macOS `say`. Nothing can be pre-rendered, every call spawns a process."""
+
+    def start(self, text):
+        command = ['say', text] if self.voice is None else ['say', '-v', self.voice, text]
+        return subprocess.Popen(command)
+
+class CachingTTSEngine(TTSEngine):
+    """Engine that renders text to PCM first, keeping the most recently used renders in an LRU cache.
+
+    Preloaded phrases are pinned in a separate cache, so a long answer cannot evict the greetings and fillers.
+    Engines that set sample_rate and implement synthesize_chunks() start playing a sentence that is not
+    cached yet while the rest of it is still being synthesized.
+    """
+
+    sample_rate = None
+
+    def __init__(self, voice=None, cache_size=64):
+        super().__init__(voice)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pinned = {}
+        self.cache_lock = threading.Lock()
+
+    def synthesize(self, text):
+        # Returns (int16 numpy array, sample_rate)
+        chunks = []
+        self.synthesize_chunks(text, chunks.append)
+        return (np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int16)), self.sample_rate
+
+    def synthesize_chunks(self, text, emit):
+        # Calls emit with each int16 numpy chunk as it is synthesized; stops early when emit returns True
+        raise NotImplementedError
+
+    def cached(self, key):
+        with self.cache_lock:
+            if key in self.pinned:
+                return self.pinned[key]
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        return None
+
+    def remember(self, key, rendered):
+        with self.cache_lock:
+            self.cache[key] = rendered
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def render(self, text):
+        key = (self.voice, text)
+        rendered = self.cached(key)
+        if rendered is None:
+            rendered = self.synthesize(text)
+            self.remember(key, rendered)
+        return rendered
+
+    def start(self, text):
+        key = (self.voice, text)
+        rendered = self.cached(key)
+        if rendered is None and self.sample_rate is not None:
+            playback = PcmPlayback(None, self.sample_rate)
+            threading.Thread(target=self.stream_to, args=(key, text, playback), daemon=True).start()
+            return playback
+        pcm, sample_rate = rendered or self.render(text)
+        return PcmPlayback(pcm, sample_rate)
+
+    def stream_to(self, key, text, playback):
+        chunks = []
+
+        def emit(chunk):
+            chunks.append(chunk)
+            playback.append(chunk)
+            # A killed playback stops synthesis too
+            return playback.finished.is_set()
+
+        try:
+            self.synthesize_chunks(text, emit)
+        except Exception as e:
+            logging.error(f"Error synthesizing speech: {e}")
+            chunks = None
+        finally:
+            playback.end()
+        if chunks and not playback.finished.is_set():
+            self.remember(key, (np.concatenate(chunks), self.sample_rate))
+
+    def preload(self, texts):
+        for text in texts:
+            rendered = self.render(text)
+            with self.cache_lock:
+                self.pinned[(self.voice, text)] = rendered
+                self.cache.pop((self.voice, text), None)
+        logging.debug(f"Pre-rendered {len(texts)} phrases.")
+
+class EspeakLibrary:
+    """libespeak-ng loaded through ctypes, so espeak synthesizes in process instead of spawning espeak-ng.
+
+    The library keeps global state, so all synthesis goes through one instance and one lock.
+    """
+
+    AUDIO_OUTPUT_SYNCHRONOUS = 2
+    POS_CHARACTER = 1
+    CHARS_UTF8 = 1
+    instance = None
+
+    @classmethod
+    def load(cls):
+        # Returns None when the shared library is not installed
+        if cls.instance is None:
+            path = ctypes.util.find_library('espeak-ng')
+            if path is None:
+                return None
+            cls.instance = cls(ctypes.CDLL(path))
+        return cls.instance
+
+    def __init__(self, library):
+        self.library = library
+        self.lock = threading.Lock()
+        self.emit = None
+        # Nothing is selected until the first synthesis, whatever voice it asks for
+        self.voice = object()
+        callback_type = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(ctypes.c_short), ctypes.c_int, ctypes.c_void_p)
+        # Kept on the instance so the callback is not garbage collected while the library holds it
+        self.callback = callback_type(self.on_samples)
+        self.sample_rate = library.espeak_Initialize(self.AUDIO_OUTPUT_SYNCHRONOUS, 200, None, 0)
+        if self.sample_rate <= 0:
+            raise RuntimeError("Could not initialize libespeak-ng.")
+        library.espeak_SetSynthCallback(self.callback)
+        library.espeak_SetVoiceByName.argtypes = [ctypes.c_char_p]
+        library.espeak_Synth.argtypes = [ctypes.c_char_p, ctypes.c_size_t, ctypes.c_uint, ctypes.c_int, ctypes.c_uint,
+                                         ctypes.c_uint, ctypes.c_void_p, ctypes.c_void_p]
+
+    def on_samples(self, samples, count, events):
+        # Called by espeak_Synth on the synthesizing thread; returning 1 aborts synthesis
+        if samples and count > 0:
+            chunk = np.ctypeslib.as_array(samples, shape=(count,)).copy()
+            if self.emit(chunk):
+                return 1
+        return 0
+
+    def synthesize(self, text, voice, emit):
+        data = text.encode('utf-8')
+        with self.lock:
+            if voice != self.voice:
+                self.library.espeak_SetVoiceByName(voice.encode() if voice else b"en")
+                self.voice = voice
+            self.emit = emit
+            try:
+                self.library.espeak_Synth(data, len(data) + 1, 0, self.POS_CHARACTER, 0, self.CHARS_UTF8, None, None)
+            finally:
+                self.emit = None
+
+class EspeakEngine(CachingTTSEngine):
+    """espeak-ng synthesized in process through libespeak-ng, falling back to the espeak-ng command when the
+    library cannot be loaded. Cached phrases play without any synthesis."""
+
+    def __init__(self, voice=None, cache_size=64):
+        super().__init__(voice, cache_size)
+        try:
+            self.library = EspeakLibrary.load()
+        except (OSError, RuntimeError) as e:
+            logging.warning(f"Could not load libespeak-ng: {e}")
+            self.library = None
+        if self.library is not None:
+            self.sample_rate = self.library.sample_rate
+        else:
+            logging.info("libespeak-ng not found. Running the espeak-ng command for each sentence instead.")
+
+    def synthesize_chunks(self, text, emit):
+        self.library.synthesize(text, self.voice, emit)
+
+    def synthesize(self, text):
+        if self.library is not None:
+            return super().synthesize(text)
+        command = ['espeak-ng', '--stdout', text] if self.voice is None else ['espeak-ng', '--stdout', '-v', self.voice, text]
+        wav_bytes = subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout
+        with wave.open(io.BytesIO(wav_bytes)) as wav_file:
+            pcm = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16)
+            return pcm, wav_file.getframerate()
+
+class PiperEngine(CachingTTSEngine):
+    """Piper voice model loaded once and synthesized in process. tts_voice is the path to the .onnx voice."""
+
+    def __init__(self, voice, cache_size=64):
+        super().__init__(voice, cache_size)
+        from piper.voice import PiperVoice
+        self.model = PiperVoice.load(voice)
+        self.sample_rate = self.model.config.sample_rate
+        logging.info(f"Piper voice '{voice}' loaded.")
+
+    def synthesize_chunks(self, text, emit):
+        for pcm in self.model.synthesize_stream_raw(text):
+            if emit(np.frombuffer(pcm, dtype=np.int16)):
+                break
+
+def create_tts_engine(config):
+    engine = config.tts_engine
+    if engine == 'auto':
+        engine = 'say' if platform.system() == 'Darwin' else 'espeak'
+    if engine == 'piper':
+        return PiperEngine(config.tts_voice, config.tts_cache_size)
+    if engine == 'espeak':
+        return EspeakEngine(config.tts_voice, config.tts_cache_size)
+    if engine == 'say':
+        return SayEngine(config.tts_voice)
+    if engine == 'null':
+        return NullEngine()
+    raise ValueError(f"Unknown tts_engine '{config.tts_engine}'.")